@@ -1,84 +1,212 @@
-from decimal import Decimal
+import uuid
+from typing import Dict, Optional
+
 from django.conf import settings
-from app_shops.models.shop import ProductShop
+from django.core.cache import cache
+from django.db import transaction
+
+from app_cart.pricing import ZERO, CartPricing, price_cart
+from app_cart.storage import CartLines, get_cart_storage
+from django_marketplace.constants import CART_CACHE_LIFETIME
+
+CART_SUMMARY_KEY = 'cart_summary:{}'
+# Атрибут запроса, в котором хранится расчет корзины: в пределах запроса корзина рассчитывается один раз
+CART_PRICING_ATTR = '_cart_pricing'
+
+
+def _user_cart_key(user_id: int) -> str:
+    return f'user:{user_id}'
+
+
+def _session_cart_key(token: str) -> str:
+    return f'session:{token}'
+
+
+def get_cart_key(request, create: bool = False) -> Optional[str]:
+    """
+    Ключ корзины в хранилище: у пользователя - по его id, у посетителя - по метке, сохраненной в сессии.
+    Сессия изменяется только при создании корзины посетителя, а не при каждом изменении корзины
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return _user_cart_key(user.id)
+    token = request.session.get(settings.CART_SESSION_ID)
+    if isinstance(token, dict):
+        # Корзина сохранена в сессии целиком до появления хранилища корзин
+        return _import_session_cart(request, token)
+    if token is None and create:
+        token = request.session[settings.CART_SESSION_ID] = uuid.uuid4().hex
+    return _session_cart_key(token) if token else None
+
+
+def _import_session_cart(request, cart: Dict) -> str:
+    token = uuid.uuid4().hex
+    cart_key = _session_cart_key(token)
+    storage = get_cart_storage()
+    for offer_id, item in cart.items():
+        storage.set_quantity(cart_key, int(offer_id), item['quantity'])
+    transaction.on_commit(lambda: _refresh_summary(cart_key, storage.get_lines(cart_key)))
+    request.session[settings.CART_SESSION_ID] = token
+    return cart_key
+
+
+def _get_summary(cart_key: str) -> Optional[Dict]:
+    return cache.get(CART_SUMMARY_KEY.format(cart_key))
+
+
+def _set_summary(cart_key: str, pricing: CartPricing, summary: Optional[Dict] = None,
+                 acknowledge: bool = False) -> None:
+    """
+    Итоги корзины для шапки сайта и цены, которые видел покупатель.
+    Для новых строк и при подтверждении запоминаются текущие цены, для остальных - прежние
+    """
+    quoted_prices = (summary or {}).get('prices') or {}
+    prices = pricing.prices
+    if not acknowledge:
+        prices = {offer_id: quoted_prices.get(offer_id, price) for offer_id, price in prices.items()}
+    new_summary = {'count': pricing.count, 'total': pricing.total, 'prices': prices}
+    if new_summary != summary:
+        cache.set(CART_SUMMARY_KEY.format(cart_key), new_summary, timeout=CART_CACHE_LIFETIME)
+
+
+def _refresh_summary(cart_key: str, lines: CartLines) -> CartPricing:
+    """Расчет корзины и запись итогов для шапки сайта с прежними ценами, которые видел покупатель"""
+    summary = _get_summary(cart_key)
+    pricing = price_cart(lines, (summary or {}).get('prices'))
+    _set_summary(cart_key, pricing, summary)
+    return pricing
 
 
 class Cart:
 
     def __init__(self, request):
-        """Инициализация объекта корзины."""
-        self.session = request.session
-        session_cart = self.session.get(settings.CART_SESSION_ID)
-        if not session_cart:
-            session_cart = self.session[settings.CART_SESSION_ID] = {}
-        self.cart = session_cart
+        """
+        Инициализация объекта корзины.
+        Содержимое корзины читается из хранилища при первом обращении, пустая корзина не создается
+        """
+        self.request = request
+        self.storage = get_cart_storage()
+        self.cart_key = get_cart_key(request)
+        self._lines = None
+
+    @property
+    def lines(self) -> CartLines:
+        if self._lines is None:
+            self._lines = self.storage.get_lines(self.cart_key) if self.cart_key else {}
+        return self._lines
+
+    def _get_or_create_key(self) -> str:
+        if self.cart_key is None:
+            self.cart_key = get_cart_key(self.request, create=True)
+        return self.cart_key
 
     def add(self, product, quantity=1, update_quantity=False):
         """
         Добавить продукт в корзину или обновить его количество.
         """
-        product_id = str(product.id)
-        if product_id not in self.cart:
-            self.cart[product_id] = {'quantity': 0, 'price': str(product.price.amount)}
+        cart_key = self._get_or_create_key()
         if update_quantity:
-            self.cart[product_id]['quantity'] = quantity
+            self.storage.set_quantity(cart_key, product.id, quantity)
         else:
-            self.cart[product_id]['quantity'] += quantity
+            self.storage.increment(cart_key, product.id, quantity)
         self.save()
 
     def minus(self, product):
         """
-        Удалить один экземпляр продукта из корзины
+        Удалить один экземпляр продукта из корзины. Строка с нулевым количеством удаляется хранилищем
         """
-        product_id = str(product.id)
-        if product_id in self.cart:
-            self.cart[product_id]['quantity'] -= 1
+        if self.cart_key:
+            self.storage.increment(self.cart_key, product.id, -1)
             self.save()
-        if self.cart[product_id]['quantity'] < 1:
-            self.remove(product)
+
+    @property
+    def pricing(self) -> CartPricing:
+        """Расчет корзины по текущим ценам, один на запрос"""
+        pricing = getattr(self.request, CART_PRICING_ATTR, None)
+        if pricing is None:
+            pricing = _refresh_summary(self.cart_key, self.lines) if self.cart_key else price_cart({})
+            setattr(self.request, CART_PRICING_ATTR, pricing)
+        return pricing
+
+    def acknowledge_prices(self):
+        """Покупатель увидел текущие цены: изменившиеся цены больше не отмечаются"""
+        if self.cart_key and self.pricing.has_changed_prices:
+            _set_summary(self.cart_key, self.pricing, _get_summary(self.cart_key), acknowledge=True)
 
     def save(self):
-        """Обновление сессии cart"""
-        self.session[settings.CART_SESSION_ID] = self.cart
-        self.session.modified = True
+        """
+        Пересчет корзины и запись итогов для шапки сайта вместе с изменением строки: после фиксации,
+        сразу за сменой версии корзины в хранилище
+        """
+        self._lines = None
+        setattr(self.request, CART_PRICING_ATTR, None)
+        transaction.on_commit(lambda: self.pricing)
 
     def remove(self, product):
         """
         Удаление товара из корзины.
         """
-        product_id = str(product.id)
-        if product_id in self.cart:
-            del self.cart[product_id]
+        if self.cart_key:
+            self.storage.remove(self.cart_key, product.id)
             self.save()
 
     def __iter__(self):
         """
         Перебор элементов в корзине и получение продуктов из базы данных.
         """
-        product_ids = self.cart.keys()
-        # получение объектов product и добавление их в корзину
-        products = ProductShop.objects.filter(id__in=product_ids).select_related('product').select_related('shop')
-        for product in products:
-            self.cart[str(product.id)]['product'] = product
-
-        for item in self.cart.values():
-            item['price'] = Decimal(item['price'])
-            item['total_price'] = item['price'] * item['quantity']
-            yield item
+        return iter(self.pricing.lines)
 
     def __len__(self):
         """
         Подсчет всех товаров в корзине.
         """
-        return sum(item['quantity'] for item in self.cart.values())
+        return self.pricing.count
 
     def get_total_price(self):
         """
         Подсчет стоимости товаров в корзине.
         """
-        return sum(Decimal(item['price']) * item['quantity'] for item in self.cart.values())
+        return self.pricing.total
 
     def clear(self):
-        """Удаление корзины из сессии"""
-        del self.session[settings.CART_SESSION_ID]
-        self.session.modified = True
\ No newline at end of file
+        """Удаление всех товаров из корзины"""
+        if self.cart_key:
+            self.storage.clear(self.cart_key)
+            self.save()
+
+
+def get_cart_summary(request) -> dict:
+    """
+    Количество товаров и сумма корзины для шапки сайта из расчета текущего запроса или итогов в кэше.
+    Итоги записываются при каждом изменении корзины и при ее просмотре. Если кэш их вытеснил,
+    корзина рассчитывается по строкам из хранилища и итоги записываются заново
+    """
+    pricing = getattr(request, CART_PRICING_ATTR, None)
+    if pricing is not None:
+        return {'count': pricing.count, 'total': pricing.total}
+    cart_key = get_cart_key(request)
+    if cart_key is None:
+        return {'count': 0, 'total': ZERO}
+    summary = _get_summary(cart_key)
+    if summary is None:
+        pricing = _refresh_summary(cart_key, get_cart_storage().get_lines(cart_key))
+        return {'count': pricing.count, 'total': pricing.total}
+    return {'count': summary['count'], 'total': summary['total']}
+
+
+def merge_carts(request, user) -> None:
+    """Перенос корзины посетителя в корзину пользователя при входе на сайт"""
+    token = request.session.get(settings.CART_SESSION_ID)
+    if not token:
+        return
+    source_key = _import_session_cart(request, token) if isinstance(token, dict) else _session_cart_key(token)
+    request.session.pop(settings.CART_SESSION_ID, None)
+    target_key = _user_cart_key(user.id)
+    storage = get_cart_storage()
+    storage.merge(source_key, target_key)
+
+    def set_summaries():
+        cache.delete(CART_SUMMARY_KEY.format(source_key))
+        _refresh_summary(target_key, storage.get_lines(target_key))
+
+    transaction.on_commit(set_summaries)
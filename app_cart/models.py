@@ -1,3 +1,18 @@
 from django.db import models
+from django.utils.translation import gettext_lazy as _
 
-# Create your models here.
+
+class CartLine(models.Model):
+    """
+    Строка корзины в базе данных: количество предложения в корзине посетителя или пользователя
+    """
+    cart_key = models.CharField(max_length=64, verbose_name=_('cart'))
+    product_shop = models.ForeignKey('app_shops.ProductShop', on_delete=models.CASCADE, related_name='in_carts',
+                                     verbose_name=_('product'))
+    quantity = models.PositiveIntegerField(default=0, verbose_name=_('quantity'))
+    updated = models.DateTimeField(auto_now=True, verbose_name=_('edited'))
+
+    class Meta:
+        verbose_name_plural = _('cart lines')
+        verbose_name = _('cart line')
+        constraints = [models.UniqueConstraint(fields=['cart_key', 'product_shop'], name='unique_cart_line')]
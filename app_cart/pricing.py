@@ -0,0 +1,57 @@
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from app_cart.storage import CartLines
+from app_shops.models.shop import ProductShop
+
+ZERO = Decimal('0.00')
+
+
+class PricedLine:
+    """
+    Строка корзины с текущей ценой предложения с учетом скидки и остатком в магазине.
+    Все суммы - Decimal в рублях, в Money они превращаются только при выводе в шаблоне
+    """
+
+    def __init__(self, offer: ProductShop, quantity: int, quoted_price: Optional[Decimal]):
+        self.product = offer
+        self.quantity = quantity
+        self.price_old = offer.price.amount
+        self.price = offer.effective_price if offer.effective_price is not None else self.price_old
+        self.total_price = self.price * quantity
+        self.available = max(offer.count_left, 0) if offer.is_active and offer.shop.is_active else 0
+        self.shortfall = max(quantity - self.available, 0)
+        self.quoted_price = quoted_price
+        self.price_changed = quoted_price is not None and quoted_price != self.price
+
+    @property
+    def has_discount(self) -> bool:
+        return self.price != self.price_old
+
+
+class CartPricing:
+    """Расчет корзины: строки, количество товаров, сумма и признаки изменившихся цен и нехватки товара"""
+
+    def __init__(self, lines: List[PricedLine]):
+        self.lines = lines
+        self.count = sum(line.quantity for line in lines)
+        self.total = sum((line.total_price for line in lines), ZERO)
+        self.has_shortfall = any(line.shortfall for line in lines)
+        self.has_changed_prices = any(line.price_changed for line in lines)
+
+    @property
+    def prices(self) -> Dict[int, Decimal]:
+        return {line.product.id: line.price for line in self.lines}
+
+
+def price_cart(lines: CartLines, quoted_prices: Optional[Dict[int, Decimal]] = None) -> CartPricing:
+    """
+    Расчет корзины одним запросом по хранимым ценам со скидкой.
+    Цена строки сравнивается с ценой, которую покупатель видел раньше; строки удаленных предложений пропускаются
+    """
+    quoted_prices = quoted_prices or {}
+    if not lines:
+        return CartPricing([])
+    offers = ProductShop.objects.filter(id__in=lines) \
+        .select_related('product__main_image', 'shop').order_by('id')
+    return CartPricing([PricedLine(offer, lines[offer.id], quoted_prices.get(offer.id)) for offer in offers])
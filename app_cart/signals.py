@@ -0,0 +1,11 @@
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+
+from app_cart.cart import merge_carts
+
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    """Корзина, собранная до входа, переносится в корзину пользователя"""
+    if request is not None:
+        merge_carts(request, user)
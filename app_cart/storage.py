@@ -0,0 +1,114 @@
+from typing import Dict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils.module_loading import import_string
+
+from app_cart.models import CartLine
+from app_shops.services.cache_versions import bump_versions, get_version
+from django_marketplace.constants import CART_CACHE_LIFETIME
+
+CART_KEY = 'cart:{}:{}'
+CART_VERSION_KEY = 'cart_version:{}'
+
+# Содержимое корзины: id предложения -> количество
+CartLines = Dict[int, int]
+
+
+class DatabaseCartStorage:
+    """
+    Хранилище корзин в таблице строк корзины.
+    Каждое изменение обновляет одну строку атомарным UPDATE, а не перезаписывает всю корзину
+    """
+
+    def get_lines(self, cart_key: str) -> CartLines:
+        return dict(CartLine.objects.filter(cart_key=cart_key).values_list('product_shop_id', 'quantity'))
+
+    def increment(self, cart_key: str, offer_id: int, delta: int) -> int:
+        """Изменение количества предложения на delta. Строка с нулевым количеством удаляется. Возвращает количество"""
+        lines = CartLine.objects.filter(cart_key=cart_key, product_shop_id=offer_id)
+        with transaction.atomic():
+            if not lines.update(quantity=Greatest(F('quantity') + delta, Value(0))):
+                if delta <= 0:
+                    return 0
+                try:
+                    with transaction.atomic():
+                        CartLine.objects.create(cart_key=cart_key, product_shop_id=offer_id, quantity=delta)
+                    return delta
+                except IntegrityError:
+                    # Строку одновременно добавил параллельный запрос
+                    lines.update(quantity=F('quantity') + delta)
+            quantity = lines.values_list('quantity', flat=True).first() or 0
+            if not quantity:
+                lines.delete()
+        return quantity
+
+    def set_quantity(self, cart_key: str, offer_id: int, quantity: int) -> int:
+        if quantity <= 0:
+            self.remove(cart_key, offer_id)
+            return 0
+        CartLine.objects.update_or_create(cart_key=cart_key, product_shop_id=offer_id,
+                                          defaults={'quantity': quantity})
+        return quantity
+
+    def remove(self, cart_key: str, offer_id: int) -> None:
+        CartLine.objects.filter(cart_key=cart_key, product_shop_id=offer_id).delete()
+
+    def clear(self, cart_key: str) -> None:
+        CartLine.objects.filter(cart_key=cart_key).delete()
+
+    def merge(self, source_key: str, target_key: str) -> None:
+        """Перенос строк одной корзины в другую со сложением количеств одинаковых предложений"""
+        with transaction.atomic():
+            for offer_id, quantity in self.get_lines(source_key).items():
+                self.increment(target_key, offer_id, quantity)
+            self.clear(source_key)
+
+
+class CacheCartStorage(DatabaseCartStorage):
+    """
+    Хранилище корзин с компактным словарем корзины в кэше перед таблицей строк.
+    Корзина читается из кэша, а при его отсутствии - одним запросом из базы.
+    Изменения атомарно записываются в базу, а после фиксации меняется версия корзины в кэше:
+    словарь не перезаписывается, а заново читается из базы при следующем обращении
+    """
+
+    def get_lines(self, cart_key: str) -> CartLines:
+        version = get_version(CART_VERSION_KEY.format(cart_key), timeout=CART_CACHE_LIFETIME)
+        key = CART_KEY.format(cart_key, version)
+        lines = cache.get(key)
+        if lines is None:
+            # Словарь, прочитанный до параллельного изменения, ляжет под прежней версией и не будет прочитан
+            lines = super().get_lines(cart_key)
+            cache.set(key, lines, timeout=CART_CACHE_LIFETIME)
+        return lines
+
+    def increment(self, cart_key: str, offer_id: int, delta: int) -> int:
+        quantity = super().increment(cart_key, offer_id, delta)
+        self._invalidate(cart_key)
+        return quantity
+
+    def set_quantity(self, cart_key: str, offer_id: int, quantity: int) -> int:
+        quantity = super().set_quantity(cart_key, offer_id, quantity)
+        self._invalidate(cart_key)
+        return quantity
+
+    def remove(self, cart_key: str, offer_id: int) -> None:
+        super().remove(cart_key, offer_id)
+        self._invalidate(cart_key)
+
+    def clear(self, cart_key: str) -> None:
+        super().clear(cart_key)
+        self._invalidate(cart_key)
+
+    @staticmethod
+    def _invalidate(cart_key: str) -> None:
+        transaction.on_commit(lambda: bump_versions([CART_VERSION_KEY.format(cart_key)], timeout=CART_CACHE_LIFETIME))
+
+
+def get_cart_storage():
+    """Хранилище корзин, заданное в настройке CART_STORAGE"""
+    return import_string(settings.CART_STORAGE)()
@@ -1,3 +1,56 @@
-from django.test import TestCase
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+
+from app_shops.models.category import Category
+from app_shops.models.product import Product
+from app_shops.models.shop import ProductShop, Shop
+
+from .cart import CART_SUMMARY_KEY, Cart, get_cart_key, get_cart_summary
+from .storage import get_cart_storage
+
+
+class CartSummaryTest(TestCase):
+    """
+    Итоги корзины для шапки сайта и строки корзины в хранилище после изменений и вытеснения из кэша
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name_ru='Телевизоры', name_en='TVs', is_active=True)
+        product = Product.objects.create(name_ru='Телевизор', name_en='TV', description_short='short',
+                                         description_long='long', category=category, is_active=True)
+        shop = Shop.objects.create(name_ru='Магазин', name_en='Shop', description='shop', phone='+79000000000',
+                                   mail='shop@example.com', address='address', is_active=True)
+        cls.offer = ProductShop.objects.create(product=product, shop=shop, price=100, count_left=5, is_active=True)
+
+    def setUp(self):
+        self.session = {}
+
+    def _request(self):
+        request = RequestFactory().get('/')
+        request.session = self.session
+        request.user = AnonymousUser()
+        return request
+
+    def _add(self, quantity):
+        with self.captureOnCommitCallbacks(execute=True):
+            Cart(self._request()).add(self.offer, quantity)
+
+    def test_storage_returns_changed_lines(self):
+        self._add(2)
+        cart_key = get_cart_key(self._request())
+        self.assertEqual(get_cart_storage().get_lines(cart_key), {self.offer.id: 2})
+        self._add(1)
+        self.assertEqual(get_cart_storage().get_lines(cart_key), {self.offer.id: 3})
+
+    def test_summary_is_rebuilt_after_cache_miss(self):
+        self._add(2)
+        summary_key = CART_SUMMARY_KEY.format(get_cart_key(self._request()))
+        self.assertEqual(get_cart_summary(self._request()), {'count': 2, 'total': Decimal('200')})
+
+        cache.delete(summary_key)
+        self.assertEqual(get_cart_summary(self._request()), {'count': 2, 'total': Decimal('200')})
+        self.assertEqual(cache.get(summary_key)['count'], 2)
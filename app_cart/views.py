@@ -35,6 +35,11 @@ def cart_remove(request, product_id):
 
 def cart_detail(request):
     cart = Cart(request)
-
-    return render(request, 'pages/cart.html', {'cart': cart})
+    # Корзина рассчитывается до вывода шапки сайта, чтобы итоги в шапке совпадали с корзиной
+    pricing = cart.pricing
+    response = render(request, 'pages/cart.html', {'cart': cart,
+                                                   'has_changed_prices': pricing.has_changed_prices,
+                                                   'has_shortfall': pricing.has_shortfall})
+    cart.acknowledge_prices()
+    return response
 
@@ -11,7 +11,10 @@ from .models.category import Category
 from .models.discount import Discount, DiscountImage
 from .models.order import PaymentCategory, DeliveryCategory, Order, OrderItem, PaymentItem, DeliveryItem
 from .models.product import ProductImage, FeatureValue, Product, TagProduct, FeatureName, FeatureToProduct, Review
+from .models.sales import SaleEvent
 from .models.shop import ShopImage, ProductShop, Shop
+from .models.statistics import ProductStatistics, CategoryStatistics
+from .services.checkout import confirm_payment
 from .models.banner import Banner
 
 AdminSite.site_header = 'Megano'
@@ -150,7 +153,7 @@ class ShopAdmin(TranslationAdmin):
 
 @admin.register(Discount)
 class DiscountAdmin(TranslationAdmin):
-    list_display = ('name', 'is_active')
+    list_display = ('name', 'is_active', 'is_applied')
     inlines = (DiscountImageInLine,)
     search_fields = ('name',)
     readonly_fields = ('slug', 'shop', 'get_image')
@@ -234,8 +237,16 @@ class DeliveryCategoryAdmin(TranslationAdmin):
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    readonly_fields = ('is_paid', )
+    list_display = ('__str__', 'buyer', 'created', 'total', 'items_count', 'is_paid', 'is_canceled', 'reserved_until')
+    list_filter = ('is_paid', 'is_canceled')
+    readonly_fields = ('is_paid', 'reserved_until', 'created', 'total', 'items_count')
     inlines = (PaymentItemInLine, DeliveryItemInLine, OrderItemInLine)
+    actions = ('mark_paid',)
+
+    @admin.action(description=_('Mark selected orders as paid'))
+    def mark_paid(self, request: HttpRequest, queryset):
+        order_ids = confirm_payment(queryset.values_list('id', flat=True))
+        self.message_user(request, _('Orders marked as paid: %(count)d') % {'count': len(order_ids)})
 
 
 @admin.register(SmallBanner)
@@ -243,3 +254,29 @@ class SmallBannerAdmin(admin.ModelAdmin):
     pass
 
 
+@admin.register(ProductStatistics)
+class ProductStatisticsAdmin(admin.ModelAdmin):
+    list_display = ('product', 'avg_price', 'min_price', 'max_price', 'avg_effective_price', 'min_effective_price',
+                    'count_sold', 'feedback', 'in_stock', 'offers_count', 'updated')
+    list_select_related = ('product',)
+    raw_id_fields = ('product',)
+
+    def has_add_permission(self, request: HttpRequest):
+        return False
+
+
+@admin.register(CategoryStatistics)
+class CategoryStatisticsAdmin(admin.ModelAdmin):
+    list_display = ('category', 'min_price', 'max_price', 'min_price_usd', 'max_price_usd', 'products_count',
+                    'in_stock_count', 'updated')
+    list_select_related = ('category',)
+
+    def has_add_permission(self, request: HttpRequest):
+        return False
+
+
+@admin.register(SaleEvent)
+class SaleEventAdmin(admin.ModelAdmin):
+    list_display = ('product_shop', 'quantity', 'created')
+    list_select_related = ('product_shop__product',)
+    raw_id_fields = ('product_shop',)
@@ -1,10 +1,9 @@
 import django_filters as filters
 from django import forms
-from django.db.models import Q
-from djmoney.contrib.exchange.models import convert_money
-from djmoney.money import Money
 
 from .models.product import Product
+from .services.feature_index import filter_by_features, get_category_ids
+from .services.search import search_products
 
 
 class ProductFilter(filters.FilterSet):
@@ -13,18 +12,39 @@ class ProductFilter(filters.FilterSet):
     price = filters.CharFilter(method='filter_price')
     name = filters.CharFilter(method='filter_name_or_description')
     in_stock = filters.BooleanFilter(method='filter_in_stock', widget=forms.CheckboxInput)
-    tag = filters.CharFilter(field_name='tags__codename')
+    tag = filters.CharFilter(method='filter_tag')
+    feature = filters.CharFilter(method='filter_feature')
 
     # Фильтр на бесплатную доставку на данный момент отсутствует
 
     def __init__(self, data=None, queryset=None, *, request=None, prefix=None):
         if data:
+            # Значения характеристик передаются несколькими параметрами feature, dict() оставил бы только последнее
+            features = sorted({int(value) for value in data.getlist('feature') if value.isdigit()})
             data = data.dict()
-            if not data.get('order_by'):
+            data['feature'] = ','.join(map(str, features))
+            if not data.get('order_by') and not data.get('name'):
+                # Результаты поиска без выбранной сортировки упорядочиваются по релевантности
                 data['order_by'] = 'count_sold'
             price = data.get('price')
             data['price'] = f'{price};{request.LANGUAGE_CODE}'
         super().__init__(data, queryset, request=request, prefix=prefix)
+        if request and request.LANGUAGE_CODE == 'en':
+            # Для английской версии сортировка по цене идет по хранимой цене в долларах
+            self.filters['order_by'].param_map['avg_price'] = 'avg_price_usd'
+
+    def facet_queryset(self):
+        """
+        Набор товаров со всеми фильтрами, кроме цены и сортировки.
+        По нему строятся фасеты, чтобы границы цен не сужались выбранным диапазоном
+        """
+        queryset = self.queryset.all()
+        if not self.is_valid():
+            return queryset
+        for name, value in self.form.cleaned_data.items():
+            if name not in ('price', 'order_by'):
+                queryset = self.filters[name].filter(queryset, value)
+        return queryset
 
     @staticmethod
     def filter_price(queryset, name, value):
@@ -32,18 +52,25 @@ class ProductFilter(filters.FilterSet):
             price_from, price_to, language_code = value.split(';')
             if price_from.isdigit() and price_to.isdigit():
                 if language_code == 'en':
-                    price_from = convert_money(Money(price_from, 'USD'), 'RUB').amount
-                    price_to = convert_money(Money(price_to, 'USD'), 'RUB').amount
+                    return queryset.filter(avg_price_usd__gte=price_from, avg_price_usd__lte=price_to)
                 return queryset.filter(avg_price__gte=price_from, avg_price__lte=price_to)
         return queryset
 
-    @staticmethod
-    def filter_name_or_description(queryset, name, value):
-        return queryset.filter(Q(name__icontains=value) | Q(description_long__icontains=value))
+    def filter_name_or_description(self, queryset, name, value):
+        return search_products(queryset, value, self.request.LANGUAGE_CODE)
 
     @staticmethod
     def filter_in_stock(queryset, name, value):
-        return queryset.filter(in_shops__count_left__gt=0)
+        return queryset.filter(statistics__in_stock=True)
+
+    @staticmethod
+    def filter_tag(queryset, name, value):
+        return queryset.with_tag(value)
+
+    def filter_feature(self, queryset, name, value):
+        value_ids = [int(value_id) for value_id in value.split(',') if value_id.isdigit()]
+        category_ids = get_category_ids(self.request.GET.get('category'))
+        return queryset.filter(id__in=filter_by_features(value_ids, category_ids))
 
     class Meta:
         model = Product
@@ -1,6 +1,9 @@
 from autoslug import AutoSlugField
+from django.core.exceptions import ValidationError
 from django.core.validators import FileExtensionValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Value
+from django.db.models.functions import Concat, Substr
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 
@@ -18,6 +21,8 @@ class Category(models.Model):
                             verbose_name=_('icon'), validators=[FileExtensionValidator(['svg'])])
     recommended_features = models.ManyToManyField('FeatureName', related_name='categories',
                                                   blank=True, verbose_name=_('recommended features'))
+    tree_path = models.CharField(max_length=255, default='', editable=False, db_index=True,
+                                 verbose_name=_('tree path'))
 
     class Meta:
         verbose_name_plural = _('categories')
@@ -27,6 +32,54 @@ class Category(models.Model):
     def __str__(self) -> str:
         return f'{self.name} ({self.parent})' if self.parent else self.name
 
+    @staticmethod
+    def build_tree_path(category_id: int, parent_path: str = '') -> str:
+        """
+        Материализованный путь категории: id всех предков и самой категории через '/'.
+        Потомки категории - это категории, путь которых начинается с ее пути
+        """
+        return f'{parent_path}{category_id}/'
+
+    @property
+    def ancestor_ids(self) -> list:
+        return [int(category_id) for category_id in self.tree_path.split('/')[:-2]]
+
+    def get_ancestors(self) -> list:
+        """Предки категории от корня, одним запросом по первичному ключу"""
+        ancestors = {category.id: category for category in Category.objects.filter(id__in=self.ancestor_ids)}
+        return [ancestors[category_id] for category_id in self.ancestor_ids if category_id in ancestors]
+
+    def get_descendants(self, include_self: bool = True) -> models.QuerySet:
+        """Потомки категории любой глубины, одним запросом по индексу пути"""
+        descendants = Category.objects.filter(tree_path__startswith=self.tree_path)
+        return descendants if include_self else descendants.exclude(pk=self.pk)
+
+    def clean(self) -> None:
+        if self.pk and self.parent_id:
+            parent_path = Category.objects.filter(pk=self.parent_id).values_list('tree_path', flat=True).first()
+            if self.parent_id == self.pk or (parent_path and self.tree_path
+                                             and parent_path.startswith(self.tree_path)):
+                raise ValidationError({'parent': _('A category cannot be nested in itself or its subcategory')})
+
+    def save(self, *args, **kwargs) -> None:
+        """Сохранение категории с обновлением материализованного пути у нее и всех ее потомков"""
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            parent_path = ''
+            if self.parent_id:
+                parent = Category.objects.filter(pk=self.parent_id)
+                parent_path = parent.values_list('tree_path', flat=True).first() or ''
+            tree_path = self.build_tree_path(self.pk, parent_path)
+            previous_path = Category.objects.filter(pk=self.pk).values_list('tree_path', flat=True).first()
+            self.tree_path = tree_path
+            if tree_path == previous_path:
+                return
+
+            Category.objects.filter(pk=self.pk).update(tree_path=tree_path)
+            if previous_path:
+                Category.objects.filter(tree_path__startswith=previous_path).exclude(pk=self.pk) \
+                    .update(tree_path=Concat(Value(tree_path), Substr('tree_path', len(previous_path) + 1)))
+
     def get_absolute_url(self) -> str:
         catalog_url = reverse('catalog')
         return f'{catalog_url}?category={self.slug}'
@@ -1,4 +1,5 @@
 import datetime
+from typing import Optional
 
 from autoslug import AutoSlugField
 from django.core.exceptions import ValidationError
@@ -34,6 +35,8 @@ class Discount(models.Model):
     date_start = models.DateTimeField(verbose_name=_('date start'), db_index=True)
     date_end = models.DateTimeField(null=True, blank=True, verbose_name=_('date end'))
     is_active = models.BooleanField(default=True, verbose_name=_('is active'))
+    is_applied = models.BooleanField(default=False, editable=False, db_index=True,
+                                     verbose_name=_('applied to prices'))
     main_image = models.OneToOneField('DiscountImage', related_name='main_for_discount', on_delete=models.SET_NULL,
                                       null=True, blank=True)
 
@@ -58,6 +61,15 @@ class Discount(models.Model):
         if self.date_end and self.date_end < self.date_start:
             raise ValidationError({'date_end': _('Date end cannot be before date start')})
 
+    def save(self, *args, **kwargs):
+        self.is_applied = self.is_in_effect()
+        super().save(*args, **kwargs)
+
+    def is_in_effect(self, now: Optional[datetime.datetime] = None) -> bool:
+        """Скидка включена и текущий момент попадает в период ее действия"""
+        now = now or timezone.now()
+        return self.is_active and self.date_start <= now and (self.date_end is None or self.date_end > now)
+
     def __str__(self) -> str:
         return f'{self.name}'
 
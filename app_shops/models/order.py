@@ -14,10 +14,27 @@ class Order(models.Model):
     is_paid = models.BooleanField(default=False, verbose_name=_('is paid'))
     is_confirmed = models.BooleanField(default=False, verbose_name=_('is confirmed'))
     is_canceled = models.BooleanField(default=False, verbose_name=_('is canceled'))
+    full_name = models.CharField(max_length=100, blank=True, verbose_name=_('full name'))
+    phone = models.CharField(max_length=100, blank=True, verbose_name=_('phone number'))
+    email = models.EmailField(blank=True, verbose_name=_('email'))
+    submission_key = models.UUIDField(null=True, blank=True, unique=True, editable=False,
+                                      verbose_name=_('submission key'))
+    reserved_until = models.DateTimeField(null=True, blank=True, db_index=True, editable=False,
+                                          verbose_name=_('reserved until'))
+    created = models.DateTimeField(auto_now_add=True, verbose_name=_('created'))
+    total = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False,
+                                verbose_name=_('total cost'))
+    items_count = models.PositiveIntegerField(default=0, editable=False, verbose_name=_('items count'))
 
     class Meta:
         verbose_name_plural = _('orders')
         verbose_name = _('order')
+        indexes = [
+            models.Index(fields=['buyer', '-created', '-id']),
+        ]
+
+    def __str__(self) -> str:
+        return f'Order #{self.id}'
 
 
 class OrderItem(models.Model):
@@ -1,10 +1,13 @@
 from autoslug import AutoSlugField
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.db.models import Avg, Case, Count, Exists, IntegerField, Max, Min, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 from imagekit.models import ProcessedImageField, ImageSpecField
 from smart_selects.db_fields import ChainedManyToManyField
-from random import sample
 
 from app_users.models import Profile
 
@@ -88,6 +91,69 @@ class FeatureToProduct(models.Model):
         unique_together = ('product', 'feature_name')
 
 
+class ProductQuerySet(models.QuerySet):
+    """
+    Набор товаров, в котором связанные записи используются только в подзапросах:
+    строки товаров не размножаются соединениями с предложениями, отзывами и тегами
+    """
+
+    def _related_aggregate(self, related_name: str, aggregate, **filters) -> Subquery:
+        """Коррелированный подзапрос агрегата по связанным записям товара"""
+        relation = self.model._meta.get_field(related_name)
+        related = relation.related_model.objects \
+            .filter(**{relation.field.name: OuterRef('pk')}, **filters) \
+            .order_by().values(relation.field.name)
+        return Subquery(related.annotate(value=aggregate).values('value'))
+
+    @staticmethod
+    def _selling_price() -> Coalesce:
+        """Цена предложения со скидкой, а до ее расчета - исходная цена"""
+        return Coalesce('effective_price', 'price', output_field=models.DecimalField(max_digits=8, decimal_places=2))
+
+    def with_offer_aggregates(self) -> 'ProductQuerySet':
+        """
+        Агрегаты по активным предложениям и отзывам товара, каждый отдельным подзапросом.
+        Цены продажи - по хранимым ценам со скидкой
+        """
+        return self.annotate(
+            avg_price=self._related_aggregate('in_shops', Avg('price'), is_active=True),
+            min_price=self._related_aggregate('in_shops', Min('price'), is_active=True),
+            max_price=self._related_aggregate('in_shops', Max('price'), is_active=True),
+            avg_effective_price=self._related_aggregate('in_shops', Avg(self._selling_price()), is_active=True),
+            min_effective_price=self._related_aggregate('in_shops', Min(self._selling_price()), is_active=True),
+            count_sold=Coalesce(self._related_aggregate('in_shops', Sum('count_sold'), is_active=True), 0),
+            count_left=Coalesce(self._related_aggregate('in_shops', Max('count_left'), is_active=True), 0),
+            offers_count=Coalesce(self._related_aggregate('in_shops', Count('id'), is_active=True), 0),
+            feedback=Coalesce(self._related_aggregate('reviews', Count('id'), is_active=True), 0),
+        )
+
+    def with_converted_prices(self) -> 'ProductQuerySet':
+        """Агрегаты по хранимым в долларах ценам активных предложений товара"""
+        return self.annotate(
+            avg_price_usd=self._related_aggregate('in_shops', Avg('price_usd'), is_active=True),
+            min_price_usd=self._related_aggregate('in_shops', Min('price_usd'), is_active=True),
+            max_price_usd=self._related_aggregate('in_shops', Max('price_usd'), is_active=True),
+        )
+
+    def with_default_offer(self) -> 'ProductQuerySet':
+        """
+        Предложение товара, добавляемое в корзину с карточки:
+        активное, в первую очередь имеющееся в наличии, затем с наименьшей ценой продажи со скидкой
+        """
+        offers = self.model._meta.get_field('in_shops').related_model.objects \
+            .filter(product=OuterRef('pk'), is_active=True) \
+            .annotate(out_of_stock=Case(When(count_left__gt=0, then=Value(0)), default=Value(1),
+                                        output_field=IntegerField())) \
+            .order_by('out_of_stock', self._selling_price().asc(), 'id')
+        return self.annotate(default_offer_id=Subquery(offers.values('id')[:1]))
+
+    def with_tag(self, codename: str) -> 'ProductQuerySet':
+        """Товары с тегом: условие EXISTS вместо соединения с таблицей тегов"""
+        tag_ids = TagProduct.objects.filter(codename=codename).values('id')
+        tags = TagProduct.goods.through.objects.filter(product_id=OuterRef('pk'), tagproduct_id__in=tag_ids)
+        return self.filter(Exists(tags))
+
+
 class Product(models.Model):
     """
     Модель товара
@@ -104,19 +170,25 @@ class Product(models.Model):
     updated = models.DateTimeField(auto_now=True, verbose_name=_('updated'))
     main_image = models.OneToOneField('ProductImage', on_delete=models.SET_NULL, null=True, blank=True,
                                       related_name='main_for_product')
+    search_vector_ru = SearchVectorField(null=True, editable=False)
+    search_vector_en = SearchVectorField(null=True, editable=False)
+
+    objects = ProductQuerySet.as_manager()
 
     class Meta:
         verbose_name_plural = _('products')
         verbose_name = _('product')
+        indexes = [
+            GinIndex(fields=['search_vector_ru']),
+            GinIndex(fields=['search_vector_en']),
+            models.Index(fields=['created', 'id']),
+        ]
 
     def __str__(self) -> str:
         return self.name
 
     def get_absolute_url(self) -> str:
         return reverse('product-detail', kwargs={'product_slug': self.slug})
-    
-    def get_random_related_id(self) -> int:
-         return sample(list(self.in_shops.filter(is_active=True)), 1)[0].id
 
 
 class ProductImage(models.Model):
@@ -148,6 +220,20 @@ class Review(models.Model):
     created = models.DateTimeField(auto_now_add=True, verbose_name=_('created'))
     is_active = models.BooleanField(default=True, verbose_name=_('is active'))
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'is_active', 'created']),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Счетчик отзывов товара обновляется сигналами в той же транзакции, что и сам отзыв
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
+
     def short_text(self):
         return self.text[:30]
 
@@ -0,0 +1,20 @@
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+
+class SaleEvent(models.Model):
+    """
+    Журнал продаж, в который записи только добавляются.
+    Периодически сворачивается в счетчики ProductShop.count_sold, чтобы продажи не блокировали строки предложений
+    """
+    product_shop = models.ForeignKey('ProductShop', on_delete=models.CASCADE, related_name='sale_events',
+                                     verbose_name=_('product in shop'))
+    quantity = models.PositiveIntegerField(default=1, verbose_name=_('quantity'))
+    created = models.DateTimeField(auto_now_add=True, verbose_name=_('created'))
+
+    class Meta:
+        verbose_name_plural = _('sale events')
+        verbose_name = _('sale event')
+
+    def __str__(self) -> str:
+        return f'Sale of offer {self.product_shop_id}: {self.quantity}'
@@ -2,7 +2,6 @@ from autoslug import AutoSlugField
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.db.models import Case, When, F
-from django.db.models.functions import Greatest
 from django.utils.translation import gettext_lazy as _
 from djmoney.models.fields import MoneyField
 from imagekit.models import ProcessedImageField, ImageSpecField
@@ -43,23 +42,9 @@ class Shop(models.Model):
 class ProductShopManager(models.Manager):
 
     def with_discount_price(self):
-        min_cost_expression = Case(
-            When(discount__is_active=False,
-                 then=None),
-            When(discount__min_cost__isnull=False,
-                 then=F('discount__min_cost'))
-        )
-        price_expression = Case(
-            When(discount__is_active=False,
-                 then=None),
-            When(discount__discount_percentage__isnull=False,
-                 then=F('price') - F('price') * F('discount__discount_percentage') / 100),
-            When(discount__discount_amount__isnull=False,
-                 then=F('price') - F('discount__discount_amount')),
-            output_field=MoneyField()
-        )
-        discount_price_expression = Greatest(price_expression, min_cost_expression)
-        return self.annotate(discount_price=discount_price_expression)
+        """Цена со скидкой из хранимой цены предложения. None, если скидка не действует"""
+        return self.annotate(discount_price=Case(When(effective_price=F('price'), then=None),
+                                                 default=F('effective_price')))
 
 
 class ProductShop(models.Model):
@@ -71,6 +56,10 @@ class ProductShop(models.Model):
     count_left = models.IntegerField(default=0, verbose_name=_('left in shop'))
     count_sold = models.IntegerField(default=0, verbose_name=_('sold in shop'))
     price = MoneyField(max_digits=8, decimal_places=2, verbose_name=_('price'), default_currency='RUB')
+    price_usd = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False,
+                                    verbose_name=_('price, USD'))
+    effective_price = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True, editable=False,
+                                          verbose_name=_('price with discount'))
     is_active = models.BooleanField(default=False, verbose_name=_('is active'))
     discount = models.ForeignKey(Discount, null=True, blank=True, on_delete=models.SET_NULL,
                                  related_name='product_in_shop')
@@ -82,6 +71,10 @@ class ProductShop(models.Model):
 
     class Meta:
         unique_together = ('product', 'shop')
+        indexes = [
+            models.Index(fields=['price_usd']),
+            models.Index(fields=['effective_price']),
+        ]
 
     def clean(self):
         if self.discount_id:
@@ -0,0 +1,77 @@
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+
+class ProductStatistics(models.Model):
+    """
+    Денормализованная статистика предложений товара, используемая каталогом для сортировки и фильтрации
+    """
+    product = models.OneToOneField('Product', on_delete=models.CASCADE, primary_key=True,
+                                   related_name='statistics', verbose_name=_('product'))
+    avg_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True,
+                                    verbose_name=_('average price'))
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True,
+                                    verbose_name=_('minimum price'))
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True,
+                                    verbose_name=_('maximum price'))
+    avg_price_usd = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True,
+                                        verbose_name=_('average price, USD'))
+    min_price_usd = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True,
+                                        verbose_name=_('minimum price, USD'))
+    max_price_usd = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True,
+                                        verbose_name=_('maximum price, USD'))
+    avg_effective_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True,
+                                              verbose_name=_('average selling price'))
+    min_effective_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True,
+                                              verbose_name=_('minimum selling price'))
+    avg_effective_price_usd = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True,
+                                                  verbose_name=_('average selling price, USD'))
+    min_effective_price_usd = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True,
+                                                  verbose_name=_('minimum selling price, USD'))
+    count_sold = models.PositiveIntegerField(default=0, verbose_name=_('sold'))
+    feedback = models.PositiveIntegerField(default=0, verbose_name=_('reviews count'))
+    in_stock = models.BooleanField(default=False, verbose_name=_('in stock'))
+    offers_count = models.PositiveIntegerField(default=0, verbose_name=_('active offers count'))
+    default_offer = models.ForeignKey('ProductShop', on_delete=models.SET_NULL, null=True, blank=True,
+                                      related_name='+', verbose_name=_('default offer'))
+    updated = models.DateTimeField(auto_now=True, verbose_name=_('updated'))
+
+    class Meta:
+        verbose_name_plural = _('product statistics')
+        verbose_name = _('product statistics')
+        indexes = [
+            models.Index(fields=['count_sold', 'product']),
+            models.Index(fields=['avg_effective_price', 'product']),
+            models.Index(fields=['avg_effective_price_usd', 'product']),
+            models.Index(fields=['feedback', 'product']),
+            models.Index(fields=['offers_count']),
+        ]
+
+    def __str__(self) -> str:
+        return f'Statistics of product: {self.product_id}'
+
+
+class CategoryStatistics(models.Model):
+    """
+    Статистика категории: границы цен активных предложений и количество товаров
+    """
+    category = models.OneToOneField('Category', on_delete=models.CASCADE, primary_key=True,
+                                    related_name='statistics', verbose_name=_('category'))
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True,
+                                    verbose_name=_('minimum price'))
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True,
+                                    verbose_name=_('maximum price'))
+    min_price_usd = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True,
+                                        verbose_name=_('minimum price, USD'))
+    max_price_usd = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True,
+                                        verbose_name=_('maximum price, USD'))
+    products_count = models.PositiveIntegerField(default=0, verbose_name=_('active products count'))
+    in_stock_count = models.PositiveIntegerField(default=0, verbose_name=_('in stock products count'))
+    updated = models.DateTimeField(auto_now=True, verbose_name=_('updated'))
+
+    class Meta:
+        verbose_name_plural = _('category statistics')
+        verbose_name = _('category statistics')
+
+    def __str__(self) -> str:
+        return f'Statistics of category: {self.category_id}'
@@ -0,0 +1,32 @@
+import time
+from typing import Dict, Hashable, Iterable, Optional
+
+from django.core.cache import BaseCache, cache as default_cache
+
+
+def new_version() -> int:
+    """
+    Новая версия ключа кэша из текущего времени: версия, созданная после вытеснения ключа версии,
+    не совпадает с версией записей, которые еще лежат в кэше, и они не становятся снова актуальными
+    """
+    return time.time_ns()
+
+
+def get_version(key: str, cache: BaseCache = default_cache, timeout: Optional[float] = None) -> int:
+    return cache.get_or_set(key, new_version, timeout=timeout)
+
+
+def get_versions(keys: Dict[Hashable, str], cache: BaseCache = default_cache,
+                 timeout: Optional[float] = None) -> Dict[Hashable, int]:
+    """Версии по их ключам одним чтением кэша, отсутствующие версии создаются"""
+    found = cache.get_many(keys.values())
+    return {name: found[key] if key in found else get_version(key, cache, timeout) for name, key in keys.items()}
+
+
+def bump_versions(keys: Iterable[str], cache: BaseCache = default_cache, timeout: Optional[float] = None) -> None:
+    """
+    Замена версий новыми. Версия записывается заново, а не увеличивается через incr:
+    файловый кэш при incr сбросил бы срок жизни ключа версии до срока по умолчанию
+    """
+    for key in set(keys):
+        cache.set(key, new_version(), timeout=timeout)
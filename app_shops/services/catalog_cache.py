@@ -0,0 +1,89 @@
+import hashlib
+import json
+from typing import Dict, Iterable, List, Optional
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import QuerySet
+
+from app_shops.models.category import Category
+from app_shops.services.cache_versions import bump_versions, get_version
+from django_marketplace.constants import CATALOG_CACHE_LIFETIME
+
+CATALOG_SCOPE_ALL = 'all'
+CATALOG_GLOBAL_SCOPE = 'global'
+CATALOG_VERSION_KEY = 'catalog_version:{}'
+CATALOG_RESULT_KEY = 'catalog:{}:{}:{}:{}'
+
+
+def _get_version(scope: str) -> int:
+    return get_version(CATALOG_VERSION_KEY.format(scope))
+
+
+def _bump_versions(scopes: Iterable[str]) -> None:
+    bump_versions(CATALOG_VERSION_KEY.format(scope) for scope in scopes)
+
+
+def normalize_filter_data(cleaned_data: Dict) -> str:
+    """
+    Канонический вид параметров фильтра: пустые значения отбрасываются, строки приводятся к нижнему регистру,
+    поэтому запросы, отличающиеся только порядком или регистром параметров, получают один ключ
+    """
+    normalized = {}
+    for name, value in cleaned_data.items():
+        if value in (None, '', [], ()):
+            continue
+        if isinstance(value, str):
+            value = ' '.join(value.lower().split())
+        elif isinstance(value, (list, tuple)):
+            value = list(value)
+        normalized[name] = value
+    return json.dumps(normalized, cls=DjangoJSONEncoder, sort_keys=True)
+
+
+def get_catalog_key(cleaned_data: Dict, category: Optional[str], language_code: str) -> str:
+    """Ключ результата каталога: версии областей кэша и хэш нормализованных параметров запроса"""
+    scope = category or CATALOG_SCOPE_ALL
+    digest = hashlib.md5(f'{language_code}|{scope}|{normalize_filter_data(cleaned_data)}'.encode()).hexdigest()
+    return CATALOG_RESULT_KEY.format(_get_version(CATALOG_GLOBAL_SCOPE), scope, _get_version(scope), digest)
+
+
+def get_cached_result(key: str) -> Optional[Dict]:
+    return cache.get(key)
+
+
+def set_cached_result(key: str, ids: Optional[List[int]], facets: Dict) -> Dict:
+    """Сохраняет упорядоченный список id товаров (None, если выдача слишком велика) и фасеты выдачи"""
+    result = {'ids': ids, 'facets': facets}
+    cache.set(key, result, timeout=CATALOG_CACHE_LIFETIME)
+    return result
+
+
+def hydrate_products(queryset: QuerySet, ids: List[int]) -> list:
+    """Загрузка товаров страницы по id с сохранением порядка выдачи"""
+    products = {product.id: product for product in queryset.filter(id__in=ids).order_by()}
+    return [products[product_id] for product_id in ids if product_id in products]
+
+
+def invalidate_catalog() -> None:
+    """Сброс всех закэшированных результатов каталога"""
+    transaction.on_commit(lambda: _bump_versions([CATALOG_GLOBAL_SCOPE]))
+
+
+def invalidate_catalog_for_products(product_ids: Iterable[int], category_ids: Iterable[int] = ()) -> None:
+    """
+    Сброс результатов каталога, в которые могут входить указанные товары:
+    результатов их категорий и всех предков этих категорий, а также результатов без фильтра по категории
+    """
+    product_ids, category_ids = list(product_ids), list(category_ids)
+
+    def bump():
+        categories = Category.objects.filter(id__in=category_ids) | \
+            Category.objects.filter(products__id__in=product_ids)
+        ancestor_ids = {ancestor_id for category in categories.only('tree_path')
+                        for ancestor_id in category.ancestor_ids}
+        slugs = Category.objects.filter(id__in=ancestor_ids) | categories
+        _bump_versions([CATALOG_SCOPE_ALL, *slugs.values_list('slug', flat=True)])
+
+    transaction.on_commit(bump)
@@ -0,0 +1,26 @@
+from app_shops.models.category import Category
+
+
+def rebuild_category_tree() -> int:
+    """
+    Полное перестроение материализованных путей категорий, например после загрузки фикстур,
+    при которой метод save модели не вызывается. Возвращает количество категорий
+    """
+    categories = {category.id: category for category in Category.objects.only('id', 'parent_id', 'tree_path')}
+    paths = {}
+
+    def resolve(category: Category, visited: tuple = ()) -> str:
+        if category.id not in paths:
+            parent = categories.get(category.parent_id)
+            if parent is None or parent.id in visited:
+                parent_path = ''
+            else:
+                parent_path = resolve(parent, (*visited, category.id))
+            paths[category.id] = Category.build_tree_path(category.id, parent_path)
+        return paths[category.id]
+
+    for category in categories.values():
+        category.tree_path = resolve(category)
+    Category.objects.bulk_update(categories.values(), ['tree_path'], batch_size=500)
+    return len(categories)
+
@@ -0,0 +1,141 @@
+import datetime
+import uuid
+from collections import Counter
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from app_shops.models.order import DeliveryItem, Order, OrderItem, PaymentItem
+from app_shops.models.shop import ProductShop
+from app_shops.services.sales import record_sales
+from app_shops.services.statistics import schedule_statistics_refresh
+from django_marketplace.constants import ORDER_RESERVATION_LIFETIME
+
+# Строка заказа: id предложения, количество, цена за единицу
+OrderLine = Tuple[int, int, Decimal]
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class EmptyOrder(CheckoutError):
+    pass
+
+
+class OutOfStock(CheckoutError):
+
+    def __init__(self, offer_ids: Iterable[int]):
+        self.offer_ids = list(offer_ids)
+        super().__init__(f'Not enough stock for offers {self.offer_ids}')
+
+
+def _reserve(offer_id: int, quantity: int) -> bool:
+    """
+    Списание остатка одним условным UPDATE: строка блокируется только на время транзакции заказа,
+    а при нехватке товара не изменяется
+    """
+    return bool(ProductShop.objects.filter(id=offer_id, is_active=True, count_left__gte=quantity)
+                .update(count_left=F('count_left') - quantity))
+
+
+def _get_oversold(lines: List[OrderLine]) -> List[int]:
+    """Предложения, которых не хватает для заказа, по остаткам без блокировок"""
+    available = dict(ProductShop.objects.filter(id__in=[offer_id for offer_id, _, _ in lines], is_active=True)
+                     .values_list('id', 'count_left'))
+    return [offer_id for offer_id, quantity, _ in lines if available.get(offer_id, 0) < quantity]
+
+
+def _refresh_statistics(offer_ids: Iterable[int]) -> None:
+    """
+    Пересчет статистики товаров предложений, остаток которых изменился, и сброс их результатов каталога.
+    Остатки меняются через UPDATE без сигналов, а статистика хранит число товаров в наличии
+    """
+    product_ids = ProductShop.objects.filter(id__in=list(offer_ids)).values_list('product_id', flat=True).distinct()
+    if product_ids:
+        schedule_statistics_refresh(*product_ids)
+
+
+def place_order(submission_key: uuid.UUID, lines: Iterable[OrderLine], buyer: Optional[User] = None,
+                delivery: Optional[Dict] = None, payment: Optional[Dict] = None, **fields) -> Order:
+    """
+    Оформление заказа в одной транзакции: заказ с итогами для истории заказов, резервирование остатков
+    условными UPDATE в порядке id предложений, строки заказа одним INSERT, доставка и оплата.
+    При нехватке хотя бы одного предложения ничего не меняется.
+    Повторная отправка с тем же ключом возвращает уже оформленный заказ
+    """
+    if order := Order.objects.filter(submission_key=submission_key).first():
+        return order
+    lines = sorted(line for line in lines if line[1] > 0)
+    if not lines:
+        raise EmptyOrder
+    reserved_until = timezone.now() + datetime.timedelta(seconds=ORDER_RESERVATION_LIFETIME)
+    try:
+        with transaction.atomic():
+            order = Order.objects.create(submission_key=submission_key, buyer=buyer, reserved_until=reserved_until,
+                                         total=sum(price * quantity for _, quantity, price in lines),
+                                         items_count=sum(quantity for _, quantity, _ in lines), **fields)
+            for offer_id, quantity, _ in lines:
+                if not _reserve(offer_id, quantity):
+                    raise OutOfStock([offer_id])
+            OrderItem.objects.bulk_create([OrderItem(order=order, product_id=offer_id, quantity=quantity,
+                                                     price_on_add_moment=price)
+                                           for offer_id, quantity, price in lines])
+            if delivery:
+                DeliveryItem.objects.create(order=order, **delivery)
+            if payment:
+                PaymentItem.objects.create(order=order, **payment)
+            _refresh_statistics([offer_id for offer_id, _, _ in lines])
+    except IntegrityError:
+        # Заказ с тем же ключом одновременно оформил параллельный запрос
+        if order := Order.objects.filter(submission_key=submission_key).first():
+            return order
+        raise
+    except OutOfStock:
+        raise OutOfStock(_get_oversold(lines))
+    return order
+
+
+def _restore_stock(order_ids: List[int]) -> None:
+    quantities = Counter()
+    for offer_id, quantity in OrderItem.objects.filter(order_id__in=order_ids).values_list('product_id', 'quantity'):
+        quantities[offer_id] += quantity
+    # Строки обновляются в порядке id, как и при резервировании, чтобы не возникало взаимных блокировок
+    for offer_id in sorted(quantities):
+        ProductShop.objects.filter(id=offer_id).update(count_left=F('count_left') + quantities[offer_id])
+    _refresh_statistics(quantities)
+
+
+def release_expired_reservations(now: Optional[datetime.datetime] = None) -> List[int]:
+    """
+    Отмена неоплаченных заказов с истекшим резервом и возврат их товаров на склад.
+    Заказы, которые обрабатывает другой процесс, пропускаются. Возвращает id отмененных заказов
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        order_ids = list(Order.objects.select_for_update(skip_locked=True)
+                         .filter(is_paid=False, is_canceled=False, reserved_until__lte=now)
+                         .values_list('id', flat=True))
+        if order_ids:
+            Order.objects.filter(id__in=order_ids).update(is_canceled=True, reserved_until=None)
+            _restore_stock(order_ids)
+    return order_ids
+
+
+def confirm_payment(order_ids: Iterable[int]) -> List[int]:
+    """
+    Отметка об оплате заказов, резерв которых еще не снят: резерв становится продажей и записывается в журнал продаж.
+    Возвращает id оплаченных заказов
+    """
+    with transaction.atomic():
+        order_ids = list(Order.objects.select_for_update()
+                         .filter(id__in=list(order_ids), is_paid=False, is_canceled=False)
+                         .values_list('id', flat=True))
+        if order_ids:
+            Order.objects.filter(id__in=order_ids).update(is_paid=True, reserved_until=None)
+            record_sales(OrderItem.objects.filter(order_id__in=order_ids).values_list('product_id', 'quantity'))
+    return order_ids
@@ -0,0 +1,128 @@
+import threading
+import time
+from decimal import Decimal
+from typing import Dict, Optional
+
+from django.db import transaction
+from django.db.models import F
+from djmoney.contrib.exchange.exceptions import MissingRate
+from djmoney.contrib.exchange.models import ExchangeBackend, get_default_backend_name
+from djmoney.money import Money
+
+from app_shops.models.shop import ProductShop
+from app_shops.services.cache_versions import bump_versions, get_version
+from app_shops.services.catalog_cache import invalidate_catalog
+from app_shops.models.statistics import CategoryStatistics, ProductStatistics
+from django_marketplace.constants import EXCHANGE_RATES_RECHECK_INTERVAL
+
+RATES_VERSION_KEY = 'exchange_rates_version'
+# Валюта, цены в которой хранятся в отдельных индексируемых столбцах рядом с ценами в базовой валюте
+CONVERTED_CURRENCY = 'USD'
+
+
+class RateTable:
+    """
+    Таблица курсов валют в памяти процесса.
+    Загружается из базы одним запросом и перечитывается только при смене версии курсов в общем кэше,
+    которая сверяется не чаще раза в EXCHANGE_RATES_RECHECK_INTERVAL секунд.
+    Поэтому конвертация цен - это арифметика над Decimal без обращений к базе
+    """
+
+    def __init__(self, recheck_interval: float = EXCHANGE_RATES_RECHECK_INTERVAL):
+        self.recheck_interval = recheck_interval
+        self.base_currency: Optional[str] = None
+        self.rates: Dict[str, Decimal] = {}
+        self.version: Optional[int] = None
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self, version: int) -> None:
+        backend = ExchangeBackend.objects.filter(name=get_default_backend_name()).prefetch_related('rates').first()
+        self.base_currency = backend.base_currency if backend else None
+        self.rates = {rate.currency: rate.value for rate in backend.rates.all()} if backend else {}
+        self.version = version
+
+    def refresh(self, force: bool = False) -> None:
+        """Сверка версии курсов и перезагрузка таблицы, если курсы обновились в любом из процессов"""
+        now = time.monotonic()
+        if not force and self.version is not None and now - self.checked_at < self.recheck_interval:
+            return
+        with self._lock:
+            version = get_version(RATES_VERSION_KEY)
+            if force or version != self.version:
+                self._load(version)
+            self.checked_at = now
+
+    def get_rate(self, source: str, target: str) -> Decimal:
+        source, target = str(source), str(target)
+        if source == target:
+            return Decimal(1)
+        self.refresh()
+        rates = {**self.rates, self.base_currency: Decimal(1)}
+        if source not in rates or target not in rates:
+            raise MissingRate(f'Rate {source} -> {target} does not exist')
+        return rates[target] / rates[source]
+
+    def invalidate(self) -> None:
+        self.version = None
+
+
+rate_table = RateTable()
+
+
+def convert_amount(amount, source: str, target: str) -> Decimal:
+    """Пересчет суммы из одной валюты в другую по таблице курсов процесса"""
+    return Decimal(amount) * rate_table.get_rate(source, target)
+
+
+def convert_money(value: Money, currency: str) -> Money:
+    """Замена djmoney convert_money, не обращающаяся к базе"""
+    return Money(convert_amount(value.amount, value.currency, currency), currency)
+
+
+def invalidate_rates() -> None:
+    """
+    Новая версия курсов после фиксации транзакции: текущий процесс перечитает курсы сразу,
+    остальные - при очередной сверке версии
+    """
+    def bump():
+        bump_versions([RATES_VERSION_KEY])
+        rate_table.invalidate()
+
+    transaction.on_commit(bump)
+
+
+def get_converted_price(amount, source: str) -> Optional[Decimal]:
+    """Цена для хранения в столбце CONVERTED_CURRENCY или None, если курса еще нет"""
+    if amount is None:
+        return None
+    try:
+        return round(convert_amount(amount, source, CONVERTED_CURRENCY), 2)
+    except MissingRate:
+        return None
+
+
+def update_converted_prices() -> None:
+    """
+    Пересчет хранимых цен в CONVERTED_CURRENCY по текущему курсу: по одному UPDATE на таблицу.
+    Средние и границы цен пересчитываются умножением на курс, так как курс один для всех строк
+    """
+    rate_table.refresh(force=True)
+    try:
+        rates = {currency: rate_table.get_rate(currency, CONVERTED_CURRENCY)
+                 for currency in ProductShop.objects.values_list('price_currency', flat=True).distinct()}
+        base_rate = rate_table.get_rate(rate_table.base_currency, CONVERTED_CURRENCY)
+    except MissingRate:
+        return
+
+    with transaction.atomic():
+        for currency, rate in rates.items():
+            ProductShop.objects.filter(price_currency=currency).update(price_usd=F('price') * rate)
+        ProductStatistics.objects.update(avg_price_usd=F('avg_price') * base_rate,
+                                         min_price_usd=F('min_price') * base_rate,
+                                         max_price_usd=F('max_price') * base_rate,
+                                         avg_effective_price_usd=F('avg_effective_price') * base_rate,
+                                         min_effective_price_usd=F('min_effective_price') * base_rate)
+        CategoryStatistics.objects.update(min_price_usd=F('min_price') * base_rate,
+                                          max_price_usd=F('max_price') * base_rate)
+        invalidate_catalog()
@@ -0,0 +1,112 @@
+import datetime
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Iterable, List, Optional
+
+from django.db import transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from app_shops.models.banner import SpecialOffer
+from app_shops.models.discount import Discount
+from app_shops.models.shop import ProductShop
+from app_shops.services.catalog_cache import invalidate_catalog_for_products
+from app_shops.services.home_sections import invalidate_home_sections, SPECIAL_OFFER
+from app_shops.services.product_page import invalidate_product_pages
+from app_shops.services.reference_cache import invalidate_reference
+from app_shops.services.statistics import schedule_statistics_refresh
+
+PRICE_PRECISION = Decimal('0.01')
+
+
+def _amount(value) -> Optional[Decimal]:
+    return getattr(value, 'amount', value)
+
+
+def get_effective_price(price: Decimal, discount: Optional[Discount]) -> Decimal:
+    """Цена предложения с учетом скидки: не ниже минимальной стоимости скидки, без скидки - исходная цена"""
+    if discount is None or not discount.is_applied:
+        return price
+    if discount.discount_percentage is not None:
+        effective_price = price - price * discount.discount_percentage / 100
+    elif discount.discount_amount is not None:
+        effective_price = price - _amount(discount.discount_amount)
+    else:
+        return price
+    if discount.min_cost is not None:
+        effective_price = max(effective_price, _amount(discount.min_cost))
+    # Округление половины от нуля, как при записи в numeric(8,2) в _effective_price_expression
+    return effective_price.quantize(PRICE_PRECISION, rounding=ROUND_HALF_UP)
+
+
+def _effective_price_expression(discount: Discount):
+    """
+    То же вычисление, что и get_effective_price, в виде выражения для UPDATE всех предложений скидки.
+    До копеек результат округляет PostgreSQL при записи в столбец numeric(8,2)
+    """
+    if not discount.is_applied:
+        return F('price')
+    if discount.discount_percentage is not None:
+        expression = F('price') - F('price') * discount.discount_percentage / 100
+    elif discount.discount_amount is not None:
+        expression = F('price') - _amount(discount.discount_amount)
+    else:
+        return F('price')
+    if discount.min_cost is not None:
+        expression = Greatest(expression, Value(_amount(discount.min_cost)))
+    return expression
+
+
+def update_effective_prices(discount_ids: Optional[Iterable[int]] = None) -> None:
+    """
+    Пересчет хранимых цен со скидкой одним UPDATE на скидку и статистики товаров, по которой каталог
+    сортирует и фильтрует по ценам продажи.
+    Если скидки не указаны, пересчитываются все предложения, в том числе без скидки
+    """
+    discounts = Discount.objects.all() if discount_ids is None else Discount.objects.filter(id__in=discount_ids)
+    offers = ProductShop.objects.all() if discount_ids is None else ProductShop.objects.filter(discount__in=discounts)
+    with transaction.atomic():
+        if discount_ids is None:
+            ProductShop.objects.filter(discount__isnull=True).update(effective_price=F('price'))
+        for discount in discounts:
+            ProductShop.objects.filter(discount=discount).update(effective_price=_effective_price_expression(discount))
+        if product_ids := set(offers.values_list('product_id', flat=True)):
+            schedule_statistics_refresh(*product_ids)
+
+
+def switch_discounts(now: Optional[datetime.datetime] = None) -> List[int]:
+    """
+    Применение скидок, период которых начался, и снятие закончившихся или выключенных.
+    Закончившиеся скидки выключаются, как и раньше. Возвращает скидки, состояние которых изменилось
+    """
+    now = now or timezone.now()
+    in_effect = Q(is_active=True, date_start__lte=now) & (Q(date_end__isnull=True) | Q(date_end__gt=now))
+    out_of_effect = Q(is_active=False) | Q(date_start__gt=now) | Q(date_end__lte=now)
+    with transaction.atomic():
+        started = list(Discount.objects.filter(in_effect, is_applied=False).values_list('id', flat=True))
+        stopped = list(Discount.objects.filter(out_of_effect, is_applied=True).values_list('id', flat=True))
+        Discount.objects.filter(id__in=started).update(is_applied=True)
+        Discount.objects.filter(id__in=stopped).update(is_applied=False)
+        Discount.objects.filter(is_active=True, date_end__lte=now).update(is_active=False)
+        update_effective_prices(started + stopped)
+    return started + stopped
+
+
+def get_discount_boundaries(until: datetime.datetime) -> List[datetime.datetime]:
+    """Ближайшие моменты начала и окончания включенных скидок до указанного времени"""
+    now = timezone.now()
+    discounts = Discount.objects.filter(is_active=True)
+    starts = discounts.filter(date_start__gt=now, date_start__lte=until).values_list('date_start', flat=True)
+    ends = discounts.filter(date_end__gt=now, date_end__lte=until).values_list('date_end', flat=True)
+    return sorted(set(starts) | set(ends))
+
+
+def invalidate_discount_caches(discount_ids: List[int]) -> None:
+    """Сброс только тех кэшей, в которых выводятся цены или состояние указанных скидок"""
+    product_ids = list(ProductShop.objects.filter(discount__in=discount_ids)
+                       .values_list('product_id', flat=True).distinct())
+    invalidate_reference('sales')
+    invalidate_product_pages(product_ids)
+    invalidate_catalog_for_products(product_ids)
+    if SpecialOffer.objects.filter(product_shop__discount__in=discount_ids).exists():
+        invalidate_home_sections([SPECIAL_OFFER])
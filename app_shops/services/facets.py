@@ -0,0 +1,69 @@
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from decimal import Decimal
+from typing import Dict, List
+
+from django.contrib.postgres.fields import ArrayField
+from django.db.models import BigIntegerField, OuterRef, QuerySet, Subquery
+
+from app_shops.models.product import TagProduct
+
+PRICE_HISTOGRAM_BUCKETS = 10
+
+
+class ArraySubquery(Subquery):
+    """Подзапрос, возвращающий столбец в виде массива PostgreSQL"""
+    template = 'ARRAY(%(subquery)s)'
+
+
+def build_price_histogram(prices: List[Decimal], buckets: int = PRICE_HISTOGRAM_BUCKETS) -> List[Dict]:
+    """
+    Гистограмма цен с корзинами одинаковой ширины.
+    Цены должны быть отсортированы: количество в каждой корзине находится бинарным поиском границ,
+    поэтому построение занимает O(buckets * log n) после единственной сортировки массива
+    """
+    if not prices:
+        return []
+    low, high = prices[0], prices[-1]
+    if low == high:
+        return [{'price_from': low, 'price_to': high, 'count': len(prices)}]
+
+    width = (high - low) / buckets
+    edges = [low + width * index for index in range(buckets)] + [high]
+    positions = [bisect_left(prices, edge) for edge in edges[:-1]] + [bisect_right(prices, high)]
+    return [{'price_from': edges[index].quantize(Decimal('0.01')),
+             'price_to': edges[index + 1].quantize(Decimal('0.01')),
+             'count': positions[index + 1] - positions[index]}
+            for index in range(buckets)]
+
+
+def get_catalog_facets(queryset: QuerySet, buckets: int = PRICE_HISTOGRAM_BUCKETS) -> Dict:
+    """
+    Фасеты каталога для набора товаров: количество товаров по тегам и категориям, количество товаров в наличии,
+    границы цен и гистограмма цен. Все данные получаются одним запросом по таблице статистики товаров
+    """
+    tags = TagProduct.goods.through.objects.filter(product_id=OuterRef('pk')).values('tagproduct_id')
+    rows = queryset.order_by() \
+        .annotate(tag_ids=ArraySubquery(tags, output_field=ArrayField(BigIntegerField()))) \
+        .values_list('category_id', 'statistics__avg_effective_price', 'statistics__in_stock', 'tag_ids')
+
+    tag_counts, category_counts = Counter(), Counter()
+    in_stock_count = 0
+    prices = []
+    for category_id, price, in_stock, tag_ids in rows:
+        category_counts[category_id] += 1
+        tag_counts.update(tag_ids)
+        in_stock_count += in_stock
+        if price is not None:
+            prices.append(price)
+    prices.sort()
+
+    return {
+        'tags': tag_counts,
+        'categories': category_counts,
+        'in_stock': in_stock_count,
+        'total': sum(category_counts.values()),
+        'min_price': prices[0] if prices else None,
+        'max_price': prices[-1] if prices else None,
+        'price_histogram': build_price_histogram(prices, buckets),
+    }
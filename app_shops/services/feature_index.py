@@ -0,0 +1,140 @@
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+from django.core.cache import cache
+from django.db import transaction
+
+from app_shops.models.category import Category
+from app_shops.models.product import FeatureToProduct, FeatureValue
+from app_shops.services.cache_versions import bump_versions, get_versions
+from django_marketplace.constants import FEATURE_INDEX_CACHE_LIFETIME
+
+FEATURE_INDEX_VERSION_KEY = 'feature_index_version:{}'
+FEATURE_INDEX_KEY = 'feature_index_ordinals:{}:{}'
+
+FeatureValues = FeatureToProduct.values.through
+
+
+def _get_versions(category_ids: Iterable[int]) -> Dict[int, int]:
+    return get_versions({category_id: FEATURE_INDEX_VERSION_KEY.format(category_id) for category_id in category_ids})
+
+
+def _to_bitmap(ordinals: Iterable[int]) -> int:
+    bitmap = 0
+    for ordinal in ordinals:
+        bitmap |= 1 << ordinal
+    return bitmap
+
+
+def _from_bitmap(bitmap: int) -> List[int]:
+    """Номера установленных битов по возрастанию: каждый раз отделяется младший установленный бит"""
+    ordinals = []
+    while bitmap:
+        lowest = bitmap & -bitmap
+        ordinals.append(lowest.bit_length() - 1)
+        bitmap ^= lowest
+    return ordinals
+
+
+def _build_index(category_id: int) -> Dict:
+    """
+    Инвертированный индекс характеристик товаров категории: список id товаров категории,
+    значение характеристики -> битовая карта товаров, у которых оно есть (бит с номером товара в списке),
+    и значение -> имя характеристики для объединения значений одной характеристики по ИЛИ.
+    Биты нумеруются по порядку товаров в категории, а не по id, поэтому длина карт не растет вместе с id
+    """
+    rows = FeatureValues.objects.filter(featuretoproduct__product__category_id=category_id) \
+        .values_list('featurevalue_id', 'featurevalue__name_id', 'featuretoproduct__product_id')
+    product_ids, features = defaultdict(list), {}
+    for value_id, feature_name_id, product_id in rows:
+        product_ids[value_id].append(product_id)
+        features[value_id] = feature_name_id
+    products = sorted({product_id for ids in product_ids.values() for product_id in ids})
+    ordinals = {product_id: ordinal for ordinal, product_id in enumerate(products)}
+    return {'products': products, 'features': features,
+            'bitmaps': {value_id: _to_bitmap(ordinals[product_id] for product_id in ids)
+                        for value_id, ids in product_ids.items()}}
+
+
+def get_feature_indexes(category_ids: Iterable[int]) -> Dict[int, Dict]:
+    """
+    Индексы текущих версий категорий: читаются из кэша одним запросом, отсутствующие строятся и сохраняются.
+    Индекс, построенный до изменения характеристик, сохраняется под прежней версией и больше не читается
+    """
+    keys = {category_id: FEATURE_INDEX_KEY.format(category_id, version)
+            for category_id, version in _get_versions(category_ids).items()}
+    cached = cache.get_many(keys.values())
+    indexes = {}
+    for category_id, key in keys.items():
+        if key not in cached:
+            cached[key] = _build_index(category_id)
+            cache.set(key, cached[key], timeout=FEATURE_INDEX_CACHE_LIFETIME)
+        indexes[category_id] = cached[key]
+    return indexes
+
+
+def get_category_ids(category_slug: Optional[str] = None) -> List[int]:
+    """Категория со всеми подкатегориями или весь каталог"""
+    if category_slug:
+        category = Category.objects.filter(slug=category_slug).first()
+        return list(category.get_descendants().values_list('id', flat=True)) if category else []
+    return list(Category.objects.values_list('id', flat=True))
+
+
+def filter_by_features(value_ids: Iterable[int], category_ids: Iterable[int]) -> List[int]:
+    """
+    Товары, у которых есть выбранные значения характеристик: значения одной характеристики
+    объединяются по ИЛИ, разные характеристики - по И. Все вычисляется на битовых картах в памяти
+    """
+    value_ids = set(value_ids)
+    if not value_ids:
+        return []
+    indexes = get_feature_indexes(category_ids).values()
+    features = {}
+    for index in indexes:
+        features.update({value_id: index['features'][value_id]
+                         for value_id in value_ids if value_id in index['features']})
+    if missing := value_ids - set(features):
+        # Значений нет ни у одного товара этих категорий, но их характеристика участвует в условии И
+        features.update(FeatureValue.objects.filter(id__in=missing).values_list('id', 'name_id'))
+
+    if not features:
+        return []
+
+    # Товар входит в одну категорию, поэтому условие проверяется по индексу каждой категории отдельно
+    product_ids = []
+    for index in indexes:
+        feature_bitmaps = defaultdict(int)
+        for value_id, feature_name_id in features.items():
+            feature_bitmaps[feature_name_id] |= index['bitmaps'].get(value_id, 0)
+        bitmaps = iter(feature_bitmaps.values())
+        result = next(bitmaps)
+        for bitmap in bitmaps:
+            result &= bitmap
+        product_ids.extend(index['products'][ordinal] for ordinal in _from_bitmap(result))
+    return product_ids
+
+
+def get_feature_values(category_ids: Iterable[int]) -> List[Dict]:
+    """Характеристики категорий со значениями, которые есть у их товаров, и количеством таких товаров"""
+    counts = defaultdict(int)
+    for index in get_feature_indexes(category_ids).values():
+        for value_id, bitmap in index['bitmaps'].items():
+            counts[value_id] += bin(bitmap).count('1')
+    values = FeatureValue.objects.filter(id__in=counts).select_related('name').order_by('name__name', 'value')
+    features = {}
+    for value in values:
+        feature = features.setdefault(value.name_id, {'name': value.name.name, 'values': []})
+        feature['values'].append({'id': value.id, 'value': value.value, 'count': counts[value.id]})
+    return list(features.values())
+
+
+def invalidate_feature_indexes(category_ids: Iterable[int]) -> None:
+    """
+    Новая версия индексов категорий после фиксации текущей транзакции: индекс перестраивается
+    при следующем чтении, а прежние версии удаляются по истечении срока жизни
+    """
+    category_ids = list({category_id for category_id in category_ids if category_id})
+    if category_ids:
+        transaction.on_commit(lambda: bump_versions(FEATURE_INDEX_VERSION_KEY.format(category_id)
+                                                    for category_id in category_ids))
@@ -0,0 +1,76 @@
+from typing import Dict, FrozenSet, Iterable, List
+
+from django.core.cache import cache
+from django.db import transaction
+
+from app_shops.models.product import FeatureToProduct
+from app_shops.services.cache_versions import bump_versions, get_version
+from django_marketplace.constants import FEATURE_MATRIX_CACHE_LIFETIME
+
+FEATURE_MATRIX_VERSION_KEY = 'feature_matrix_version:{}'
+FEATURE_MATRIX_KEY = 'feature_matrix:{}:{}'
+FEATURE_COMPARISON_KEY = 'feature_comparison:{}:{}:{}:{}'
+
+# Матрица категории: товар -> характеристика -> набор id значений
+FeatureMatrix = Dict[int, Dict[int, FrozenSet[int]]]
+
+
+def _get_version(category_id: int) -> int:
+    return get_version(FEATURE_MATRIX_VERSION_KEY.format(category_id))
+
+
+def _build_matrix(category_id: int) -> FeatureMatrix:
+    rows = FeatureToProduct.objects.filter(product__category_id=category_id) \
+        .values_list('product_id', 'feature_name_id', 'values').order_by()
+    matrix = {}
+    for product_id, feature_name_id, value_id in rows:
+        values = matrix.setdefault(product_id, {}).setdefault(feature_name_id, set())
+        if value_id is not None:
+            values.add(value_id)
+    return {product_id: {feature_name_id: frozenset(values) for feature_name_id, values in features.items()}
+            for product_id, features in matrix.items()}
+
+
+def get_feature_matrix(category_id: int, version: int) -> FeatureMatrix:
+    key = FEATURE_MATRIX_KEY.format(category_id, version)
+    matrix = cache.get(key)
+    if matrix is None:
+        matrix = _build_matrix(category_id)
+        cache.set(key, matrix, timeout=FEATURE_MATRIX_CACHE_LIFETIME)
+    return matrix
+
+
+def _compare(matrix: FeatureMatrix, product_ids: List[int], differing: bool) -> List[int]:
+    features = [matrix.get(product_id, {}) for product_id in product_ids]
+    common = set.intersection(*[set(item) for item in features]) if features else set()
+    if differing:
+        common = {feature_name_id for feature_name_id in common
+                  if len({item[feature_name_id] for item in features}) > 1}
+    return sorted(common)
+
+
+def compare_features(category_id: int, product_ids: Iterable[int], differing: bool = False) -> List[int]:
+    """
+    Характеристики, которые есть у всех сравниваемых товаров категории,
+    а при differing - только те из них, значения которых у товаров различаются.
+    Результат кэшируется по отсортированному набору товаров до изменения характеристик категории
+    """
+    product_ids = sorted(set(product_ids))
+    version = _get_version(category_id)
+    key = FEATURE_COMPARISON_KEY.format(category_id, version, ','.join(map(str, product_ids)), int(differing))
+    result = cache.get(key)
+    if result is None:
+        result = _compare(get_feature_matrix(category_id, version), product_ids, differing)
+        cache.set(key, result, timeout=FEATURE_MATRIX_CACHE_LIFETIME)
+    return result
+
+
+def invalidate_feature_matrix(category_ids: Iterable[int]) -> None:
+    """
+    Новая версия матриц категорий после фиксации текущей транзакции:
+    прежние матрицы и сравнения по ним больше не читаются и удаляются по истечении срока жизни
+    """
+    category_ids = list({category_id for category_id in category_ids if category_id})
+    if category_ids:
+        transaction.on_commit(lambda: bump_versions(FEATURE_MATRIX_VERSION_KEY.format(category_id)
+                                                    for category_id in category_ids))
@@ -1,6 +1,11 @@
+from django.db import transaction
+from djmoney import settings
 from djmoney.contrib.exchange.backends.base import BaseExchangeBackend
 import requests
 
+from app_shops.services.currency import invalidate_rates, update_converted_prices
+from app_shops.services.home_sections import invalidate_home_sections
+
 
 class CBRExchangeBackend(BaseExchangeBackend):
     GAIN = 0.001
@@ -18,3 +23,10 @@ class CBRExchangeBackend(BaseExchangeBackend):
             return {'USD': exchange_rate}
         except (requests.exceptions.Timeout, requests.ConnectionError):
             return {'USD': 0.0115}
+
+    def update_rates(self, base_currency=settings.BASE_CURRENCY, **kwargs):
+        """Сохранение новых курсов, сброс таблиц курсов во всех процессах и пересчет хранимых цен в долларах"""
+        super().update_rates(base_currency, **kwargs)
+        invalidate_rates()
+        transaction.on_commit(update_converted_prices)
+        invalidate_home_sections()
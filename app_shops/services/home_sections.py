@@ -0,0 +1,133 @@
+from typing import Callable, Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Min
+from django.utils import timezone
+from django.utils.translation import get_language
+
+from app_shops.models.banner import Banner, SmallBanner, SpecialOffer
+from app_shops.models.product import Product
+from app_shops.models.shop import ProductShop
+from app_shops.services.currency import get_converted_price
+from app_shops.services.sales import get_top_sellers
+from django_marketplace.constants import HOME_SECTION_CACHE_LIFETIME
+
+HOME_SECTION_KEY = 'home:{}:{}'
+TOP_GOODS = 'top_goods'
+BANNERS = 'banners'
+SMALL_BANNERS = 'small_banners'
+SPECIAL_OFFER = 'special_offer'
+HOME_SECTIONS = (TOP_GOODS, BANNERS, SMALL_BANNERS, SPECIAL_OFFER)
+
+TOP_GOODS_COUNT = 8
+BANNERS_COUNT = 3
+
+
+def _image_url(image) -> Optional[str]:
+    return image.url if image else None
+
+
+def _build_top_goods() -> List[Dict]:
+    """Самые продаваемые товары из рейтинга продаж с ценами и предложением по умолчанию для кнопки корзины"""
+    top_sellers = get_top_sellers(limit=TOP_GOODS_COUNT)
+    products = Product.objects.filter(id__in=top_sellers).select_related('category', 'main_image') \
+        .annotate(avg_price=F('statistics__avg_price'),
+                  avg_price_usd=F('statistics__avg_price_usd'),
+                  offer_id=F('statistics__default_offer'))
+    products = sorted(products, key=lambda product: top_sellers.index(product.id))
+    return [{'name': product.name,
+             'slug': product.slug,
+             'url': product.get_absolute_url(),
+             'image_url': _image_url(product.main_image and product.main_image.middle),
+             'category': product.category.name,
+             'avg_price': product.avg_price,
+             'avg_price_usd': product.avg_price_usd,
+             'offer_id': product.offer_id}
+            for product in products]
+
+
+def _build_banners() -> List[Dict]:
+    banners = Banner.objects.filter(is_active=True).select_related('product')[:BANNERS_COUNT]
+    return [{'name': banner.product.name,
+             'description_short': banner.product.description_short,
+             'url': banner.product.get_absolute_url(),
+             'image_url': _image_url(banner.photo)}
+            for banner in banners]
+
+
+def _build_small_banners() -> List[Dict]:
+    banners = SmallBanner.objects.select_related('product')[:BANNERS_COUNT] \
+        .annotate(price_from=Min('product__in_shops__price'), price_from_usd=Min('product__in_shops__price_usd'))
+    return [{'name': banner.product.name,
+             'slug': banner.product.slug,
+             'url': banner.product.get_absolute_url(),
+             'image_url': _image_url(banner.photo),
+             'price_from': banner.price_from,
+             'price_from_usd': banner.price_from_usd}
+            for banner in banners]
+
+
+def _build_special_offer() -> Optional[Dict]:
+    """Товар со счетчиком времени. Ключ кэша живет не дольше окончания предложения"""
+    special_offer = SpecialOffer.objects.first()
+    if special_offer is None:
+        return None
+    offer = ProductShop.objects.with_discount_price() \
+        .select_related('product__category', 'product__main_image') \
+        .get(id=special_offer.product_shop_id)
+    price = offer.price.amount
+    discount_price = getattr(offer.discount_price, 'amount', offer.discount_price)
+    if discount_price is None:
+        discount_price = price
+    return {'name': offer.product.name,
+            'url': offer.product.get_absolute_url(),
+            'image_url': _image_url(offer.product.main_image and offer.product.main_image.middle),
+            'category': str(offer.product.category),
+            'price': price,
+            'price_usd': offer.price_usd,
+            'discount_price': discount_price,
+            'discount_price_usd': get_converted_price(discount_price, offer.price.currency),
+            'date_end': special_offer.date_end}
+
+
+SECTION_BUILDERS: Dict[str, Callable] = {
+    TOP_GOODS: _build_top_goods,
+    BANNERS: _build_banners,
+    SMALL_BANNERS: _build_small_banners,
+    SPECIAL_OFFER: _build_special_offer,
+}
+
+
+def _get_timeout(section: str, data) -> float:
+    if section == SPECIAL_OFFER and data and data['date_end']:
+        seconds_left = (data['date_end'] - timezone.now()).total_seconds()
+        if seconds_left > 0:
+            return min(HOME_SECTION_CACHE_LIFETIME, seconds_left)
+    return HOME_SECTION_CACHE_LIFETIME
+
+
+def get_home_sections() -> Dict:
+    """
+    Данные секций главной страницы для текущего языка.
+    Все секции читаются из кэша одним запросом, отсутствующие вычисляются и сохраняются
+    """
+    language_code = get_language()
+    keys = {section: HOME_SECTION_KEY.format(section, language_code) for section in HOME_SECTIONS}
+    cached = cache.get_many(keys.values())
+    sections = {}
+    for section, key in keys.items():
+        if key in cached:
+            sections[section] = cached[key]
+            continue
+        sections[section] = data = SECTION_BUILDERS[section]()
+        cache.set(key, data, timeout=_get_timeout(section, data))
+    return sections
+
+
+def invalidate_home_sections(sections: Iterable[str] = HOME_SECTIONS) -> None:
+    """Сброс секций главной страницы на всех языках после фиксации текущей транзакции"""
+    keys = [HOME_SECTION_KEY.format(section, language_code)
+            for section in sections for language_code, _ in settings.LANGUAGES]
+    transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,26 @@
+from typing import Optional
+
+from django.contrib.auth.models import User
+from django.db.models import Prefetch, QuerySet
+
+from app_shops.models.order import Order, OrderItem
+from app_shops.services.pagination import KeysetPage, KeysetPaginator
+from django_marketplace.constants import ORDERS_PAGE_SIZE
+
+
+def get_buyer_orders(buyer: User) -> QuerySet:
+    """Заказы покупателя с доставкой, оплатой и строками: строки всех заказов выбираются одним запросом"""
+    items = OrderItem.objects.select_related('product__product__main_image').order_by('id')
+    return Order.objects.filter(buyer=buyer) \
+        .select_related('delivery_items__category', 'payment_items__category') \
+        .prefetch_related(Prefetch('items', queryset=items))
+
+
+def get_orders_page(buyer: User, cursor: Optional[str] = None) -> KeysetPage:
+    """
+    Страница истории заказов покупателя, новые первыми.
+    Выбирается по индексу (buyer, created, id) и курсору на последний заказ предыдущей страницы,
+    итоги заказов хранятся в самих заказах и не суммируются по строкам
+    """
+    orders = get_buyer_orders(buyer).order_by('-created', '-id')
+    return KeysetPaginator(orders, ORDERS_PAGE_SIZE).get_page(cursor)
@@ -0,0 +1,215 @@
+import base64
+import binascii
+import json
+from typing import Any, List, Optional, Sequence, Tuple
+
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q, QuerySet
+from django.http import HttpRequest
+from django.utils.functional import cached_property
+
+from django_marketplace.constants import PAGE_NUMBER_LIMIT
+
+CURSOR_PARAM = 'cursor'
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def get_keyset_ordering(queryset: QuerySet) -> Tuple[str, ...]:
+    """
+    Возвращает сортировку набора записей, дополненную первичным ключом,
+    чтобы позиция каждой записи в выдаче была однозначной
+    """
+    ordering = [field for field in queryset.query.order_by if isinstance(field, str)]
+    if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+        ordering.append('-id' if ordering and ordering[-1].startswith('-') else 'id')
+    return tuple(ordering)
+
+
+def order_by_keyset(queryset: QuerySet, ordering: Sequence[str]) -> QuerySet:
+    """
+    Сортировка набора записей по ключу постраничной навигации.
+    Записи с пустым значением поля идут последними в обоих направлениях сортировки
+    """
+    return queryset.order_by(*[F(field[1:]).desc(nulls_last=True) if field.startswith('-')
+                               else F(field).asc(nulls_last=True) for field in ordering])
+
+
+class KeysetPage:
+    """
+    Страница, полученная по курсору. Совместима с шаблонами постраничной навигации Django
+    """
+    number = None
+
+    def __init__(self, object_list: List, paginator: 'KeysetPaginator', has_next: bool, has_previous: bool):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self) -> bool:
+        return self._has_next and bool(self.object_list)
+
+    def has_previous(self) -> bool:
+        return self._has_previous and bool(self.object_list)
+
+    def has_other_pages(self) -> bool:
+        return self.has_next() or self.has_previous()
+
+    @cached_property
+    def next_cursor(self) -> Optional[str]:
+        return self.paginator.encode_cursor(self.object_list[-1], NEXT) if self.has_next() else None
+
+    @cached_property
+    def previous_cursor(self) -> Optional[str]:
+        return self.paginator.encode_cursor(self.object_list[0], PREVIOUS) if self.has_previous() else None
+
+
+class KeysetPaginator:
+    """
+    Постраничная навигация по ключу сортировки (keyset pagination).
+    Вместо OFFSET страница выбирается условием на значения сортировки граничной записи,
+    поэтому стоимость запроса не растет с номером страницы, а общее количество записей не считается
+    """
+    page_range = range(0)
+
+    def __init__(self, queryset: QuerySet, per_page: int, ordering: Optional[Sequence[str]] = None):
+        self.ordering = tuple(ordering) if ordering else get_keyset_ordering(queryset)
+        self.queryset = order_by_keyset(queryset, self.ordering)
+        self.per_page = per_page
+
+    @cached_property
+    def count(self) -> int:
+        """Точное количество записей. Считается только при явном обращении"""
+        return self.queryset.count()
+
+    @staticmethod
+    def _get_value(obj, field: str) -> Any:
+        value = obj
+        for attr in field.lstrip('-').split('__'):
+            value = getattr(value, attr)
+        return value
+
+    def encode_cursor(self, obj, direction: str) -> str:
+        """Непрозрачный курсор на запись: направление перехода и значения полей сортировки"""
+        payload = {'d': direction, 'v': [self._get_value(obj, field) for field in self.ordering]}
+        data = json.dumps(payload, cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+    def decode_cursor(self, cursor: str) -> Tuple[str, list]:
+        try:
+            data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            payload = json.loads(data)
+            direction, values = payload['d'], payload['v']
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise InvalidCursor(cursor)
+        if direction not in (NEXT, PREVIOUS) or not isinstance(values, list) or len(values) != len(self.ordering):
+            raise InvalidCursor(cursor)
+        return direction, values
+
+    @staticmethod
+    def _after(field: str, value: Any, backwards: bool) -> Optional[Q]:
+        """
+        Условие "значение поля после граничного". Пустые значения идут после всех остальных,
+        поэтому при переходе назад после пустого идут все непустые, а при переходе вперед - ни одно
+        """
+        name = field.lstrip('-')
+        if value is None:
+            return Q(**{f'{name}__isnull': False}) if backwards else None
+        descending = field.startswith('-') != backwards
+        condition = Q(**{f'{name}__{"lt" if descending else "gt"}': value})
+        return condition if backwards else condition | Q(**{f'{name}__isnull': True})
+
+    @staticmethod
+    def _equal(field: str, value: Any) -> Q:
+        name = field.lstrip('-')
+        return Q(**{f'{name}__isnull': True}) if value is None else Q(**{name: value})
+
+    def _keyset_filter(self, values: list, backwards: bool) -> Q:
+        """Условие "запись находится после граничной" для составного ключа сортировки"""
+        condition = Q()
+        for index, field in enumerate(self.ordering):
+            step = self._after(field, values[index], backwards)
+            if step is None:
+                continue
+            for previous_field, previous_value in zip(self.ordering[:index], values[:index]):
+                step &= self._equal(previous_field, previous_value)
+            condition |= step
+        return condition
+
+    def get_page(self, cursor: Optional[str] = None) -> KeysetPage:
+        direction, values = NEXT, None
+        if cursor:
+            try:
+                direction, values = self.decode_cursor(cursor)
+            except InvalidCursor:
+                pass
+
+        backwards = direction == PREVIOUS
+        queryset = self.queryset
+        if values is not None:
+            queryset = queryset.filter(self._keyset_filter(values, backwards))
+        if backwards:
+            queryset = queryset.reverse()
+
+        object_list = list(queryset[:self.per_page + 1])
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+        if backwards:
+            object_list.reverse()
+            return KeysetPage(object_list, self, has_next=True, has_previous=has_more)
+        return KeysetPage(object_list, self, has_next=has_more, has_previous=values is not None)
+
+
+class ShallowPaginator(Paginator):
+    """
+    Постраничная навигация по номерам страниц для первых max_pages страниц.
+    Количество записей считается не дальше этих страниц, переход за последнюю из них выполняется по курсору
+    """
+
+    def __init__(self, object_list: QuerySet, per_page: int, keyset: KeysetPaginator,
+                 max_pages: int = PAGE_NUMBER_LIMIT, **kwargs):
+        super().__init__(keyset.queryset, per_page, **kwargs)
+        self.keyset = keyset
+        self.max_pages = max_pages
+        self.has_more = False
+
+    @cached_property
+    def count(self) -> int:
+        limit = self.max_pages * self.per_page
+        count = self.object_list[:limit + 1].count()
+        self.has_more = count > limit
+        return min(count, limit)
+
+    def page(self, number):
+        page = super().page(number)
+        page.next_cursor = page.previous_cursor = None
+        if page.number == self.num_pages and self.has_more and len(page):
+            page.next_cursor = self.keyset.encode_cursor(page[len(page) - 1], NEXT)
+        return page
+
+
+def paginate(queryset: QuerySet, per_page: int, request: HttpRequest) -> tuple:
+    """
+    Возвращает пагинатор и текущую страницу: первые страницы доступны по номеру,
+    дальнейшие - по курсору из параметра запроса cursor
+    """
+    keyset = KeysetPaginator(queryset, per_page)
+    if cursor := request.GET.get(CURSOR_PARAM):
+        return keyset, keyset.get_page(cursor)
+    paginator = ShallowPaginator(queryset, per_page, keyset)
+    return paginator, paginator.get_page(request.GET.get('page'))
@@ -0,0 +1,95 @@
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils.translation import get_language
+
+from app_shops.models.product import Product, FeatureToProduct
+from app_shops.models.shop import ProductShop
+from django_marketplace.constants import PRODUCT_PAGE_CACHE_LIFETIME
+
+# Версия структуры снимка: увеличивается при изменении его полей, чтобы не читать снимки прежнего формата
+PRODUCT_PAGE_VERSION = 1
+PRODUCT_PAGE_KEY = 'product_page:{}:{}:{}'
+
+
+def _get_key(slug: str, language_code: str) -> str:
+    return PRODUCT_PAGE_KEY.format(PRODUCT_PAGE_VERSION, slug, language_code)
+
+
+def _image(image) -> Dict:
+    return {'id': image.id, 'name': str(image), 'middle_url': image.middle.url, 'small_url': image.small.url}
+
+
+def _seller(offer: ProductShop) -> Dict:
+    discount_price = getattr(offer.discount_price, 'amount', offer.discount_price)
+    return {'offer_id': offer.id,
+            'shop_name': offer.shop.name,
+            'price_old': offer.price.amount,
+            'price_new': discount_price}
+
+
+def _build_snapshot(slug: str) -> Optional[Dict]:
+    """
+    Данные страницы товара за один проход: товар с изображениями, тегами, характеристиками
+    и ценами продавцов с учетом скидок
+    """
+    offers = ProductShop.objects.with_discount_price().filter(is_active=True).select_related('shop').order_by('id')
+    features = FeatureToProduct.objects.select_related('feature_name').prefetch_related('values').order_by('id')
+    product = Product.objects.filter(slug=slug) \
+        .select_related('category', 'main_image', 'statistics') \
+        .prefetch_related('images', 'tags', Prefetch('features', queryset=features),
+                          Prefetch('in_shops', queryset=offers)) \
+        .first()
+    if product is None:
+        return None
+
+    sellers = [_seller(offer) for offer in product.in_shops.all()]
+    prices = [seller['price_new'] or seller['price_old'] for seller in sellers]
+    statistics = getattr(product, 'statistics', None)
+    return {'id': product.id,
+            'slug': product.slug,
+            'name': product.name,
+            'description_short': product.description_short,
+            'description_long': product.description_long,
+            'category': str(product.category),
+            'main_image': _image(product.main_image) if product.main_image else None,
+            'images': [_image(image) for image in product.images.all() if image.id != product.main_image_id],
+            'tags': [tag.name for tag in product.tags.all()],
+            'features': [{'name': str(feature.feature_name), 'values': [str(value) for value in feature.values.all()]}
+                         for feature in product.features.all()],
+            'sellers': sellers,
+            'price': sum(prices) / len(prices) if prices else None,
+            'reviews_count': statistics.feedback if statistics else 0,
+            'default_offer_id': statistics.default_offer_id if statistics else None}
+
+
+def get_product_snapshot(slug: str) -> Optional[Dict]:
+    """Снимок страницы товара для текущего языка. None, если товара нет"""
+    key = _get_key(slug, get_language())
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = _build_snapshot(slug)
+        if snapshot is not None:
+            cache.set(key, snapshot, timeout=PRODUCT_PAGE_CACHE_LIFETIME)
+    return snapshot
+
+
+def _delete_snapshots(product_ids: List[int], slugs: List[str]) -> None:
+    if product_ids:
+        slugs = slugs + list(Product.objects.filter(id__in=product_ids).values_list('slug', flat=True))
+    cache.delete_many([_get_key(slug, language_code)
+                       for slug in slugs for language_code, _ in settings.LANGUAGES])
+
+
+def invalidate_product_pages(product_ids: Iterable[int] = (), slugs: Iterable[str] = ()) -> None:
+    """
+    Сброс снимков страниц товаров на всех языках после фиксации текущей транзакции.
+    Удаленные товары передаются по slug: после фиксации найти их по id уже нельзя
+    """
+    product_ids = [product_id for product_id in product_ids if product_id]
+    slugs = list(slugs)
+    if product_ids or slugs:
+        transaction.on_commit(lambda: _delete_snapshots(product_ids, slugs))
@@ -0,0 +1,186 @@
+import math
+import random
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from app_shops.services.cache_versions import bump_versions, get_versions
+from django_marketplace.constants import REFERENCE_CACHE_MAX_ENTRIES, REFERENCE_CACHE_RECHECK_INTERVAL, \
+    REFERENCE_CACHE_LOCK_TIMEOUT, REFERENCE_CACHE_EARLY_EXPIRATION_BETA
+
+REFERENCE_KEY = 'reference:{}:{}'
+REFERENCE_VERSION_KEY = 'reference_version:{}'
+REFERENCE_LOCK_KEY = 'reference_lock:{}'
+# Как часто процесс, ожидающий построения значения другим процессом, проверяет общий кэш
+REFERENCE_WAIT_STEP = 0.05
+
+
+class ReferenceCache:
+    """
+    Двухуровневый кэш справочных данных: ограниченный LRU в памяти процесса перед общим кэшем.
+    Значение перестраивается одним процессом и одним потоком под блокировкой, остальные в это время
+    получают прежнее значение или ждут нового. Перестроение начинается заранее с вероятностью, растущей
+    к истечению срока жизни (XFetch). Сброс значения увеличивает его версию в общем кэше, и процессы
+    замечают новую версию не позже чем через recheck_interval
+    """
+
+    def __init__(self, max_entries: int = REFERENCE_CACHE_MAX_ENTRIES,
+                 recheck_interval: float = REFERENCE_CACHE_RECHECK_INTERVAL,
+                 lock_timeout: float = REFERENCE_CACHE_LOCK_TIMEOUT,
+                 beta: float = REFERENCE_CACHE_EARLY_EXPIRATION_BETA):
+        self.max_entries = max_entries
+        self.recheck_interval = recheck_interval
+        self.lock_timeout = lock_timeout
+        self.beta = beta
+        self._entries: OrderedDict = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._version_lock = threading.Lock()
+        self._build_locks = defaultdict(threading.Lock)
+
+    @property
+    def shared(self):
+        return caches[settings.REFERENCE_CACHE]
+
+    def _check_version(self, name: str) -> Tuple[Optional[int], bool]:
+        """Версия, известная процессу, если сверять версии еще рано, и признак того, что пора сверить все"""
+        with self._lock:
+            recheck = time.monotonic() - self._checked_at >= self.recheck_interval
+            return (None if recheck else self._versions.get(name)), recheck
+
+    def _get_version(self, name: str) -> int:
+        """
+        Версия значения из общего кэша. Версии всех известных процессу значений сверяются одним запросом.
+        Общий кэш читается под отдельной блокировкой сверки, чтобы чтение и запись значений в памяти
+        процесса не ждали его ответа. Под общей блокировкой версии только заменяются
+        """
+        version, recheck = self._check_version(name)
+        if version is not None:
+            return version
+        with self._version_lock:
+            # Пока поток ждал блокировку, версии мог сверить другой поток
+            version, recheck = self._check_version(name)
+            if version is not None:
+                return version
+            names = {*self._versions, name} if recheck else {name}
+            keys = {name: REFERENCE_VERSION_KEY.format(name) for name in names}
+            versions = get_versions(keys, self.shared)
+            with self._lock:
+                if recheck:
+                    self._versions = versions
+                    self._checked_at = time.monotonic()
+                else:
+                    self._versions.update(versions)
+            return versions[name]
+
+    def _get_local(self, name: str, version: int) -> Optional[Dict]:
+        with self._lock:
+            item = self._entries.get(name)
+            if item is None or item[0] != version:
+                return None
+            self._entries.move_to_end(name)
+            return item[1]
+
+    def _set_local(self, name: str, version: int, entry: Dict) -> None:
+        with self._lock:
+            self._entries[name] = (version, entry)
+            self._entries.move_to_end(name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _is_fresh(self, entry: Optional[Dict]) -> bool:
+        """
+        Значение не истекло и не выбрано для досрочного перестроения: вероятность перестроения растет
+        по мере приближения к сроку истечения и тем быстрее, чем дольше строится значение
+        """
+        if entry is None:
+            return False
+        early = entry['delta'] * self.beta * -math.log(1.0 - random.random())
+        return time.time() + early < entry['expires']
+
+    def get(self, name: str, build: Callable[[], Any], timeout: float) -> Any:
+        """Значение из памяти процесса, затем из общего кэша. Если его нет или оно устаревает - построение"""
+        version = self._get_version(name)
+        entry = self._get_local(name, version)
+        if entry is None:
+            entry = self.shared.get(REFERENCE_KEY.format(name, version))
+            if entry is not None:
+                self._set_local(name, version, entry)
+        if self._is_fresh(entry):
+            return entry['value']
+        return self._rebuild(name, version, build, timeout, entry)
+
+    def _rebuild(self, name: str, version: int, build: Callable[[], Any], timeout: float,
+                 stale: Optional[Dict]) -> Any:
+        build_lock = self._build_locks[name]
+        # Пока другой поток строит значение, остальные получают прежнее, если оно еще не истекло
+        if stale is not None and time.time() < stale['expires']:
+            if not build_lock.acquire(blocking=False):
+                return stale['value']
+        else:
+            build_lock.acquire()
+        try:
+            entry = self._get_local(name, version)
+            if entry is not stale and entry is not None and time.time() < entry['expires']:
+                return entry['value']
+
+            lock_key = REFERENCE_LOCK_KEY.format(name)
+            if not self.shared.add(lock_key, True, timeout=self.lock_timeout):
+                # Значение строит другой процесс
+                if stale is not None and time.time() < stale['expires']:
+                    return stale['value']
+                if (entry := self._wait(name, version)) is not None:
+                    return entry['value']
+                return build()
+            try:
+                started = time.monotonic()
+                value = build()
+                entry = {'value': value, 'delta': time.monotonic() - started, 'expires': time.time() + timeout}
+                self.shared.set(REFERENCE_KEY.format(name, version), entry, timeout=timeout)
+                self._set_local(name, version, entry)
+                return value
+            finally:
+                self.shared.delete(lock_key)
+        finally:
+            build_lock.release()
+
+    def _wait(self, name: str, version: int) -> Optional[Dict]:
+        """Ожидание значения, которое строит другой процесс, не дольше срока его блокировки"""
+        key = REFERENCE_KEY.format(name, version)
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(REFERENCE_WAIT_STEP)
+            if (entry := self.shared.get(key)) is not None:
+                self._set_local(name, version, entry)
+                return entry
+            if self.shared.get(REFERENCE_LOCK_KEY.format(name)) is None:
+                break
+        return None
+
+    def _bump_versions(self, names: Iterable[str]) -> None:
+        bump_versions([REFERENCE_VERSION_KEY.format(name) for name in names], self.shared)
+        with self._lock:
+            for name in names:
+                self._versions.pop(name, None)
+                self._entries.pop(name, None)
+
+    def invalidate(self, *names: str) -> None:
+        """Новая версия значений после фиксации текущей транзакции: во всех процессах они будут перестроены"""
+        transaction.on_commit(lambda: self._bump_versions(names))
+
+
+reference_cache = ReferenceCache()
+
+
+def get_reference(name: str, build: Callable[[], Any], timeout: float) -> Any:
+    return reference_cache.get(name, build, timeout)
+
+
+def invalidate_reference(*names: str) -> None:
+    reference_cache.invalidate(*names)
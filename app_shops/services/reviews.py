@@ -0,0 +1,31 @@
+from typing import Optional
+
+from django.db.models import F
+
+from app_shops.models.product import Review
+from app_shops.models.statistics import ProductStatistics
+from app_shops.services.pagination import KeysetPage, KeysetPaginator
+from app_shops.services.statistics import schedule_statistics_refresh
+from django_marketplace.constants import REVIEWS_PAGE_SIZE
+
+
+def get_reviews_page(product_id: int, cursor: Optional[str] = None) -> KeysetPage:
+    """
+    Страница активных отзывов товара, новые первыми.
+    Выбирается по индексу (product, is_active, created) и курсору на последний отзыв предыдущей страницы
+    """
+    reviews = Review.objects.filter(product_id=product_id, is_active=True).select_related('profile') \
+        .order_by('-created')
+    return KeysetPaginator(reviews, REVIEWS_PAGE_SIZE).get_page(cursor)
+
+
+def change_reviews_count(product_id: int, delta: int) -> None:
+    """
+    Изменение счетчика активных отзывов в статистике товара в текущей транзакции.
+    Если статистики у товара еще нет, она пересчитывается целиком после фиксации
+    """
+    if not delta:
+        return
+    updated = ProductStatistics.objects.filter(product_id=product_id).update(feedback=F('feedback') + delta)
+    if not updated:
+        schedule_statistics_refresh(product_id)
@@ -0,0 +1,139 @@
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from app_shops.models.category import Category
+from app_shops.models.sales import SaleEvent
+from app_shops.models.shop import ProductShop
+from app_shops.models.statistics import ProductStatistics
+from app_shops.services.statistics import refresh_product_statistics
+from django_marketplace.constants import TOP_SELLERS_SIZE, TOP_SELLERS_CACHE_LIFETIME, SALES_FLUSH_BATCH_SIZE
+
+TOP_SELLERS_KEY = 'top_sellers:{}'
+TOP_SELLERS_ALL = 'all'
+SALES_FLUSH_LOCK_KEY = 'sales_flush_lock'
+SALES_FLUSH_LOCK_TIMEOUT = 5 * 60
+
+
+def record_sales(items: Iterable[Tuple[int, int]]) -> None:
+    """
+    Запись продаж (id предложения, количество) в журнал.
+    Строки ProductShop при этом не блокируются: счетчики обновит периодическая задача flush_sales
+    """
+    SaleEvent.objects.bulk_create([SaleEvent(product_shop_id=product_shop_id, quantity=quantity)
+                                   for product_shop_id, quantity in items if quantity > 0])
+
+
+def _build_leaderboard(scope) -> List[List[int]]:
+    """Рейтинг из статистики товаров по индексу (count_sold, product): список пар [id товара, продано]"""
+    statistics = ProductStatistics.objects.filter(product__is_active=True, offers_count__gt=0)
+    if scope != TOP_SELLERS_ALL:
+        tree_path = Category.objects.filter(id=scope).values_list('tree_path', flat=True).first()
+        if not tree_path:
+            return []
+        statistics = statistics.filter(product__category__tree_path__startswith=tree_path)
+    rows = statistics.order_by('-count_sold', 'product').values_list('product_id', 'count_sold')[:TOP_SELLERS_SIZE]
+    return [list(row) for row in rows]
+
+
+def get_top_sellers(category_id: Optional[int] = None, limit: int = TOP_SELLERS_SIZE) -> List[int]:
+    """Id самых продаваемых товаров категории вместе с подкатегориями или всего каталога, по убыванию продаж"""
+    scope = category_id or TOP_SELLERS_ALL
+    key = TOP_SELLERS_KEY.format(scope)
+    leaderboard = cache.get(key)
+    if leaderboard is None:
+        leaderboard = _build_leaderboard(scope)
+        cache.set(key, leaderboard, timeout=TOP_SELLERS_CACHE_LIFETIME)
+    return [product_id for product_id, _ in leaderboard[:limit]]
+
+
+def _merge_leaderboard(leaderboard: List[List[int]], updates: Dict[int, Optional[int]]) -> List[List[int]]:
+    """
+    Слияние рейтинга с новыми значениями продаж товаров: None исключает товар из рейтинга.
+    Продажи только растут, поэтому товар вне рейтинга может попасть в него только через обновление
+    """
+    ranked = dict(leaderboard)
+    for product_id, count_sold in updates.items():
+        if count_sold is None:
+            ranked.pop(product_id, None)
+        else:
+            ranked[product_id] = count_sold
+    ordered = sorted(ranked.items(), key=lambda item: (-item[1], item[0]))
+    return [list(item) for item in ordered[:TOP_SELLERS_SIZE]]
+
+
+def _update_leaderboards(product_ids: Iterable[int]) -> None:
+    """
+    Обновление закэшированных рейтингов всего каталога, категорий товаров и их предков.
+    Полный рейтинг, из которого выбыл товар, строится заново: его место занимает товар не из рейтинга
+    """
+    updates = defaultdict(dict)
+    rows = ProductStatistics.objects.filter(product_id__in=product_ids) \
+        .values_list('product_id', 'count_sold', 'offers_count', 'product__is_active', 'product__category__tree_path')
+    for product_id, count_sold, offers_count, is_active, tree_path in rows:
+        value = count_sold if is_active and offers_count else None
+        for scope in (TOP_SELLERS_ALL, *(int(category_id) for category_id in tree_path.split('/')[:-1])):
+            updates[scope][product_id] = value
+
+    for scope, scope_updates in updates.items():
+        key = TOP_SELLERS_KEY.format(scope)
+        # Отсутствующий рейтинг будет построен при первом чтении
+        if (leaderboard := cache.get(key)) is not None:
+            merged = _merge_leaderboard(leaderboard, scope_updates)
+            if len(merged) < len(leaderboard) and len(leaderboard) >= TOP_SELLERS_SIZE:
+                merged = _build_leaderboard(scope)
+            cache.set(key, merged, timeout=TOP_SELLERS_CACHE_LIFETIME)
+
+
+def invalidate_top_sellers(category_ids: Iterable[int] = (), product_ids: Iterable[int] = ()) -> None:
+    """
+    Сброс рейтингов всего каталога, указанных категорий, категорий указанных товаров и их предков
+    после фиксации транзакции
+    """
+    category_ids, product_ids = list(category_ids), list(product_ids)
+
+    def delete():
+        scopes = {TOP_SELLERS_ALL}
+        categories = Category.objects.filter(id__in=category_ids) | \
+            Category.objects.filter(products__id__in=product_ids)
+        for category in categories.only('tree_path'):
+            scopes.update([category.id, *category.ancestor_ids])
+        cache.delete_many([TOP_SELLERS_KEY.format(scope) for scope in scopes])
+
+    transaction.on_commit(delete)
+
+
+def flush_sales(batch_size: int = SALES_FLUSH_BATCH_SIZE) -> List[int]:
+    """
+    Сворачивание журнала продаж в счетчики предложений: по одному UPDATE на предложение за проход.
+    Затем пересчитывается статистика товаров и обновляются рейтинги. Возвращает id товаров с новыми продажами.
+    Записи журнала блокируются до удаления: проход, начатый после истечения блокировки в кэше,
+    пропускает их и не учитывает продажи дважды
+    """
+    if not cache.add(SALES_FLUSH_LOCK_KEY, True, timeout=SALES_FLUSH_LOCK_TIMEOUT):
+        return []
+    try:
+        with transaction.atomic():
+            events = list(SaleEvent.objects.select_for_update(skip_locked=True).order_by('id')
+                          .values_list('id', 'product_shop_id', 'quantity')[:batch_size])
+            if not events:
+                return []
+            totals = Counter()
+            for _, product_shop_id, quantity in events:
+                totals[product_shop_id] += quantity
+            # Строки обновляются в порядке id, чтобы параллельные транзакции не приводили к взаимной блокировке
+            for product_shop_id in sorted(totals):
+                ProductShop.objects.filter(id=product_shop_id) \
+                    .update(count_sold=F('count_sold') + totals[product_shop_id])
+            SaleEvent.objects.filter(id__in=[event_id for event_id, _, _ in events]).delete()
+            product_ids = list(ProductShop.objects.filter(id__in=totals).values_list('product_id', flat=True)
+                               .distinct())
+
+        refresh_product_statistics(product_ids)
+        _update_leaderboards(product_ids)
+        return product_ids
+    finally:
+        cache.delete(SALES_FLUSH_LOCK_KEY)
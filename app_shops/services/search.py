@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db.models import DecimalField, F, QuerySet
+from django.db.models.functions import Cast
+
+# Конфигурации полнотекстового поиска PostgreSQL для языков сайта
+SEARCH_CONFIGS = {
+    'ru': 'russian',
+    'en': 'english',
+}
+
+
+def get_search_language(language_code: str) -> str:
+    """Возвращает язык поиска, соответствующий языку запроса"""
+    return language_code if language_code in SEARCH_CONFIGS else settings.MODELTRANSLATION_DEFAULT_LANGUAGE
+
+
+def build_search_vector(language_code: str) -> SearchVector:
+    """Поисковый вектор товара по переведенным полям с весами: название, краткое и полное описание"""
+    config = SEARCH_CONFIGS[language_code]
+    return SearchVector(f'name_{language_code}', weight='A', config=config) + \
+        SearchVector(f'description_short_{language_code}', weight='B', config=config) + \
+        SearchVector(f'description_long_{language_code}', weight='C', config=config)
+
+
+def update_search_vectors(queryset: QuerySet) -> None:
+    """Пересчет поисковых векторов товаров одним запросом UPDATE"""
+    queryset.update(**{f'search_vector_{language_code}': build_search_vector(language_code)
+                       for language_code in SEARCH_CONFIGS})
+
+
+def search_products(queryset: QuerySet, query: str, language_code: str) -> QuerySet:
+    """
+    Полнотекстовый поиск товаров по индексированному вектору языка запроса.
+    Если сортировка не выбрана, результаты упорядочиваются по релевантности.
+    Релевантность округляется до numeric: значение real из курсора постраничной навигации,
+    прочитанное как double, не совпало бы с исходным при сравнении
+    """
+    language_code = get_search_language(language_code)
+    vector_field = f'search_vector_{language_code}'
+    search_query = SearchQuery(query, config=SEARCH_CONFIGS[language_code], search_type='websearch')
+    rank = Cast(SearchRank(F(vector_field), search_query), DecimalField(max_digits=12, decimal_places=6))
+    queryset = queryset.filter(**{vector_field: search_query}).annotate(rank=rank)
+    return queryset if queryset.query.order_by else queryset.order_by('-rank')
@@ -0,0 +1,172 @@
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Max, Min, Model, Q
+
+from app_shops.models.category import Category
+from app_shops.models.product import Product
+from app_shops.models.statistics import ProductStatistics, CategoryStatistics
+from app_shops.services.catalog_cache import invalidate_catalog_for_products
+from app_shops.services.currency import get_converted_price
+from app_shops.services.reference_cache import invalidate_reference
+
+STATISTICS_BATCH_SIZE = 500
+
+
+def _upsert(model, objects: Iterable[Model]) -> None:
+    """
+    Запись строк статистики одним INSERT ... ON CONFLICT по первичному ключу.
+    В отличие от удаления и вставки, параллельные пересчеты одних и тех же строк не нарушают первичный ключ.
+    Строки записываются в порядке ключа, чтобы параллельные пересчеты не блокировали друг друга взаимно
+    """
+    objects = sorted(objects, key=lambda obj: obj.pk)
+    if not objects:
+        return
+    meta = model._meta
+    fields = meta.concrete_fields
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(field.column) for field in fields)
+    updates = ', '.join(f'{quote(field.column)} = EXCLUDED.{quote(field.column)}'
+                        for field in fields if not field.primary_key)
+    placeholders = ', '.join(['(%s)' % ', '.join(['%s'] * len(fields))] * len(objects))
+    params = [field.get_db_prep_save(field.pre_save(obj, add=True), connection)
+              for obj in objects for field in fields]
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {quote(meta.db_table)} ({columns}) VALUES {placeholders} '
+                       f'ON CONFLICT ({quote(meta.pk.column)}) DO UPDATE SET {updates}', params)
+
+
+def _collect_statistics(product_ids: Iterable[int]) -> list:
+    """
+    Вычисление статистики для пачки товаров.
+    Каждый агрегат считается отдельным подзапросом, поэтому строки ProductShop и Review не размножают друг друга
+    """
+    products = Product.objects.filter(id__in=product_ids).order_by() \
+        .with_offer_aggregates().with_converted_prices().with_default_offer() \
+        .values('id', 'avg_price', 'min_price', 'max_price', 'avg_price_usd', 'min_price_usd', 'max_price_usd',
+                'avg_effective_price', 'min_effective_price', 'count_sold', 'count_left', 'offers_count', 'feedback',
+                'default_offer_id')
+
+    return [ProductStatistics(product_id=item['id'],
+                              avg_price=item['avg_price'],
+                              min_price=item['min_price'],
+                              max_price=item['max_price'],
+                              avg_price_usd=item['avg_price_usd'],
+                              min_price_usd=item['min_price_usd'],
+                              max_price_usd=item['max_price_usd'],
+                              avg_effective_price=item['avg_effective_price'],
+                              min_effective_price=item['min_effective_price'],
+                              avg_effective_price_usd=get_converted_price(item['avg_effective_price'],
+                                                                          settings.BASE_CURRENCY),
+                              min_effective_price_usd=get_converted_price(item['min_effective_price'],
+                                                                          settings.BASE_CURRENCY),
+                              count_sold=max(item['count_sold'], 0),
+                              offers_count=item['offers_count'],
+                              default_offer_id=item['default_offer_id'],
+                              in_stock=item['count_left'] > 0,
+                              feedback=item['feedback'])
+            for item in products]
+
+
+def refresh_product_statistics(product_ids: Optional[Iterable[int]] = None) -> None:
+    """
+    Пересчёт статистики предложений для указанных товаров.
+    Если товары не указаны, статистика перестраивается полностью
+    """
+    if product_ids is None:
+        product_ids = Product.objects.order_by('id').values_list('id', flat=True)
+    product_ids = list(set(product_ids))
+
+    for start in range(0, len(product_ids), STATISTICS_BATCH_SIZE):
+        batch = product_ids[start:start + STATISTICS_BATCH_SIZE]
+        # Статистика удаленных товаров удаляется вместе с ними каскадно
+        _upsert(ProductStatistics, _collect_statistics(batch))
+
+
+def refresh_category_statistics(category_ids: Optional[Iterable[int]] = None) -> None:
+    """
+    Пересчёт статистики категорий по статистике активных товаров категории и всех ее подкатегорий.
+    Нижняя граница цен - по ценам продажи со скидкой, по которым фильтрует каталог.
+    Если категории не указаны, статистика перестраивается полностью
+    """
+    tree_paths = dict(Category.objects.values_list('id', 'tree_path'))
+    if category_ids is None:
+        category_ids = list(tree_paths)
+    category_ids = {category_id for category_id in category_ids if category_id in tree_paths}
+    prefixes = tuple(tree_paths[category_id] for category_id in category_ids if tree_paths[category_id])
+    subtree_ids = [category_id for category_id, tree_path in tree_paths.items()
+                   if category_id in category_ids or (prefixes and tree_path.startswith(prefixes))]
+
+    own_aggregates = ProductStatistics.objects \
+        .filter(product__category__in=subtree_ids, product__is_active=True, offers_count__gt=0) \
+        .values('product__category') \
+        .annotate(min_price_value=Min('min_effective_price'), max_price_value=Max('max_price'),
+                  min_price_usd_value=Min('min_effective_price_usd'), max_price_usd_value=Max('max_price_usd'),
+                  products=Count('product'), in_stock_products=Count('product', filter=Q(in_stock=True))) \
+        .order_by()
+    aggregates = {}
+    for item in own_aggregates:
+        # Агрегаты категории добавляются к ней самой и ко всем ее предкам из пути в дереве
+        own_id = item['product__category']
+        path_ids = {int(category_id) for category_id in tree_paths[own_id].split('/')[:-1]} | {own_id}
+        for category_id in category_ids & path_ids:
+            total = aggregates.setdefault(category_id, {'products': 0, 'in_stock_products': 0})
+            total['products'] += item['products']
+            total['in_stock_products'] += item['in_stock_products']
+            for key, choose in (('min_price_value', min), ('max_price_value', max),
+                                ('min_price_usd_value', min), ('max_price_usd_value', max)):
+                values = [value for value in (total.get(key), item[key]) if value is not None]
+                total[key] = choose(values) if values else None
+
+    previous_counts = {
+        item['category_id']: (item['products_count'], item['in_stock_count'])
+        for item in CategoryStatistics.objects.filter(category_id__in=category_ids)
+        .values('category_id', 'products_count', 'in_stock_count')
+    }
+
+    statistics = []
+    for category_id in category_ids:
+        item = aggregates.get(category_id, {})
+        statistics.append(CategoryStatistics(category_id=category_id,
+                                             min_price=item.get('min_price_value'),
+                                             max_price=item.get('max_price_value'),
+                                             min_price_usd=item.get('min_price_usd_value'),
+                                             max_price_usd=item.get('max_price_usd_value'),
+                                             products_count=item.get('products', 0),
+                                             in_stock_count=item.get('in_stock_products', 0)))
+    _upsert(CategoryStatistics, statistics)
+
+    # Меню категорий в шапке показывает количество товаров, кэш сбрасывается только при его изменении
+    if any(previous_counts.get(item.category_id) != (item.products_count, item.in_stock_count)
+           for item in statistics):
+        invalidate_reference('categories')
+
+
+def get_price_bounds(category_slug: Optional[str] = None) -> dict:
+    """Границы цен активных предложений категории или всего каталога из статистики категорий"""
+    statistics = CategoryStatistics.objects.all()
+    if category_slug:
+        statistics = statistics.filter(category__slug=category_slug)
+    return statistics.aggregate(min_price=Min('min_price'), max_price=Max('max_price'),
+                                min_price_usd=Min('min_price_usd'), max_price_usd=Max('max_price_usd'))
+
+
+def _refresh_statistics(product_ids: Iterable[int], category_ids: Iterable[int]) -> None:
+    refresh_product_statistics(product_ids)
+    category_ids = {*category_ids, *Product.objects.filter(id__in=product_ids).values_list('category_id', flat=True)}
+    # Статистика категории включает товары подкатегорий, поэтому пересчитываются и все предки
+    ancestor_ids = {ancestor_id for category in Category.objects.filter(id__in=category_ids).only('tree_path')
+                    for ancestor_id in category.ancestor_ids}
+    refresh_category_statistics(category_ids | ancestor_ids)
+    # Закэшированные результаты каталога отфильтрованы и отсортированы по статистике товаров
+    invalidate_catalog_for_products(product_ids, category_ids)
+
+
+def schedule_statistics_refresh(*product_ids: int, category_ids: Iterable[int] = ()) -> None:
+    """
+    Пересчёт статистики товаров и их категорий после фиксации текущей транзакции.
+    В category_ids передаются категории, которые товары могли покинуть
+    """
+    category_ids = [category_id for category_id in category_ids if category_id]
+    transaction.on_commit(lambda: _refresh_statistics(product_ids, category_ids))
@@ -1,24 +1,190 @@
 import contextlib
-from django.core.cache import cache
-from django.db import IntegrityError
-from django.db.models.signals import post_save, post_delete
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete, m2m_changed
 from django.dispatch import receiver
+from django.utils import timezone
+from kombu.exceptions import OperationalError
 
+from django_marketplace.constants import DISCOUNT_SCHEDULE_HORIZON
+from .models.banner import Banner, SmallBanner, SpecialOffer
 from .models.category import Category
 from .models.discount import Discount
-from .models.product import Product, FeatureToProduct
+from .models.product import Product, FeatureToProduct, ProductImage, Review, TagProduct, FeatureName, FeatureValue
+from .models.shop import ProductShop, Shop
+from .services.catalog_cache import invalidate_catalog, invalidate_catalog_for_products
+from .services.currency import get_converted_price
+from .services.discounts import get_effective_price, update_effective_prices
+from .services.feature_index import invalidate_feature_indexes
+from .services.feature_matrix import invalidate_feature_matrix
+from .services.home_sections import invalidate_home_sections, TOP_GOODS, BANNERS, SMALL_BANNERS, \
+    SPECIAL_OFFER
+from .services.product_page import invalidate_product_pages
+from .services.reference_cache import invalidate_reference
+from .services.reviews import change_reviews_count
+from .services.sales import invalidate_top_sellers
+from .services.search import update_search_vectors
+from .services.statistics import schedule_statistics_refresh
+from .tasks import switch_discounts
 
 
 @receiver([post_save, post_delete], sender=Category)
 def invalidate_cache_category(**kwargs) -> None:
     """Удаление из кэша категории товаров, в случае изменения таблицы Category из админки"""
-    cache.delete('categories')
+    invalidate_reference('categories')
+    invalidate_catalog()
 
 
 @receiver([post_save, post_delete], sender=Discount)
 def invalidate_cache_discount(**kwargs) -> None:
     """Удаление из кэша скидок, в случае изменения таблицы Discount из админки"""
-    cache.delete('sales')
+    invalidate_reference('sales')
+    invalidate_home_sections([SPECIAL_OFFER])
+
+
+@receiver([post_save, post_delete], sender=Banner)
+def invalidate_home_banners(**kwargs) -> None:
+    invalidate_home_sections([BANNERS])
+
+
+@receiver([post_save, post_delete], sender=SmallBanner)
+def invalidate_home_small_banners(**kwargs) -> None:
+    invalidate_home_sections([SMALL_BANNERS])
+
+
+@receiver([post_save, post_delete], sender=SpecialOffer)
+def invalidate_home_special_offer(**kwargs) -> None:
+    invalidate_home_sections([SPECIAL_OFFER])
+
+
+@receiver([post_save, post_delete], sender=ProductShop)
+def invalidate_home_prices(**kwargs) -> None:
+    """Цены и продажи предложений используются в популярных товарах, малых баннерах и предложении с таймером"""
+    invalidate_home_sections([TOP_GOODS, SMALL_BANNERS, SPECIAL_OFFER])
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductImage)
+def invalidate_home_products(**kwargs) -> None:
+    """Названия, описания и изображения товаров есть во всех секциях главной страницы"""
+    invalidate_home_sections()
+
+
+@receiver([pre_save], sender=ProductShop)
+def apply_product_shop_discount(**kwargs) -> None:
+    """Хранимая цена предложения со скидкой. При загрузке фикстур скидка могла еще не загрузиться"""
+    instance: ProductShop = kwargs.get('instance')
+    if instance.price is not None:
+        discount = Discount.objects.filter(id=instance.discount_id).first() \
+            if instance.discount_id and not kwargs.get('raw') else None
+        instance.effective_price = get_effective_price(instance.price.amount, discount)
+
+
+@receiver([post_save], sender=Discount)
+def update_discount_effective_prices(**kwargs) -> None:
+    """Пересчет цен со скидкой всех предложений скидки при ее создании или изменении"""
+    update_effective_prices([kwargs.get('instance').id])
+
+
+def _enqueue_discount_switches(boundaries: list) -> None:
+    for boundary in boundaries:
+        # Без брокера граница будет обработана периодическим планированием скидок
+        with contextlib.suppress(OperationalError):
+            switch_discounts.apply_async(eta=boundary)
+
+
+@receiver([post_save], sender=Discount)
+def schedule_discount_switches(**kwargs) -> None:
+    """Задачи точно на начало и окончание скидки, если они наступят раньше следующего планирования скидок"""
+    instance: Discount = kwargs.get('instance')
+    if kwargs.get('raw') or not instance.is_active:
+        return
+    now = timezone.now()
+    horizon = now + timedelta(seconds=DISCOUNT_SCHEDULE_HORIZON)
+    boundaries = [boundary for boundary in (instance.date_start, instance.date_end)
+                  if boundary and now < boundary <= horizon]
+    if boundaries:
+        transaction.on_commit(lambda: _enqueue_discount_switches(boundaries))
+
+
+@receiver([pre_delete], sender=Discount)
+def reset_discount_effective_prices(**kwargs) -> None:
+    """Связь предложений с удаляемой скидкой обнуляется без сигналов, поэтому цены сбрасываются заранее"""
+    offers = ProductShop.objects.filter(discount=kwargs.get('instance'))
+    offers.update(effective_price=F('price'))
+    if product_ids := set(offers.values_list('product_id', flat=True)):
+        schedule_statistics_refresh(*product_ids)
+
+
+@receiver([pre_save], sender=ProductShop)
+def convert_product_shop_price(**kwargs) -> None:
+    """Цена предложения в долларах по текущему курсу для фильтрации и сортировки без конвертации в запросе"""
+    instance: ProductShop = kwargs.get('instance')
+    if instance.price is not None:
+        instance.price_usd = get_converted_price(instance.price.amount, instance.price.currency)
+
+
+@receiver([post_save, post_delete], sender=ProductShop)
+def update_product_statistics(**kwargs) -> None:
+    """Пересчёт статистики товара при изменении его предложений"""
+    instance = kwargs.get('instance')
+    schedule_statistics_refresh(instance.product_id)
+
+
+@receiver([pre_save], sender=Review)
+def remember_review_activity(**kwargs) -> None:
+    """Запоминание прежней активности отзыва, чтобы изменить счетчик отзывов товара только при ее смене"""
+    instance: Review = kwargs.get('instance')
+    instance.previous_is_active = Review.objects.filter(pk=instance.pk).values_list('is_active', flat=True) \
+        .first() if instance.pk else False
+
+
+@receiver([post_save], sender=Review)
+def update_reviews_count(**kwargs) -> None:
+    """Изменение счетчика отзывов товара при добавлении, скрытии или публикации отзыва"""
+    instance: Review = kwargs.get('instance')
+    change_reviews_count(instance.product_id, int(instance.is_active) - int(bool(instance.previous_is_active)))
+
+
+@receiver([post_delete], sender=Review)
+def decrease_reviews_count(**kwargs) -> None:
+    instance: Review = kwargs.get('instance')
+    if instance.is_active:
+        change_reviews_count(instance.product_id, -1)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def update_product_and_category_statistics(**kwargs) -> None:
+    """Пересчёт статистики товара и его категорий, прежней и текущей"""
+    instance: Product = kwargs.get('instance')
+    schedule_statistics_refresh(instance.id, category_ids=[instance.category_id,
+                                                          getattr(instance, 'previous_category_id', None)])
+
+
+@receiver([post_save, post_delete], sender=ProductShop)
+def invalidate_top_sellers_product_shop(**kwargs) -> None:
+    """
+    Сброс рейтингов продаж при изменении предложения из админки: продажи и активность меняются не только продажами.
+    Обработчик зарегистрирован после пересчета статистики, по которой рейтинг строится заново
+    """
+    invalidate_top_sellers(product_ids=[kwargs.get('instance').product_id])
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_top_sellers_product(**kwargs) -> None:
+    """Сброс рейтингов продаж прежней и текущей категории товара"""
+    instance: Product = kwargs.get('instance')
+    category_ids = [instance.category_id, getattr(instance, 'previous_category_id', None)]
+    invalidate_top_sellers([category_id for category_id in category_ids if category_id])
+
+
+@receiver([post_save], sender=Product)
+def update_product_search_vectors(**kwargs) -> None:
+    """Обновление поисковых векторов товара после сохранения"""
+    instance: Product = kwargs.get('instance')
+    update_search_vectors(Product.objects.filter(pk=instance.pk))
 
 
 @receiver([post_save], sender=Product)
@@ -36,3 +202,214 @@ def add_recommended_features_to_product(**kwargs) -> None:
         if objects:
             with contextlib.suppress(IntegrityError):
                 FeatureToProduct.objects.bulk_create(objects)
+
+
+@receiver([post_save, post_delete], sender=ProductShop)
+@receiver([post_save, post_delete], sender=Review)
+def invalidate_catalog_cache_product_related(**kwargs) -> None:
+    """Сброс кэша каталога, в выдаче которого может быть товар измененного предложения или отзыва"""
+    invalidate_catalog_for_products([kwargs.get('instance').product_id])
+
+
+@receiver([pre_save], sender=Product)
+def remember_product_category(**kwargs) -> None:
+    """Запоминание прежней категории товара, чтобы сбросить кэш каталога и для нее"""
+    instance: Product = kwargs.get('instance')
+    instance.previous_category_id = Product.objects.filter(pk=instance.pk).values_list('category_id', flat=True) \
+        .first() if instance.pk else None
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_catalog_cache_product(**kwargs) -> None:
+    """Сброс кэша каталога для категорий товара"""
+    instance: Product = kwargs.get('instance')
+    category_ids = [instance.category_id, getattr(instance, 'previous_category_id', None)]
+    invalidate_catalog_for_products([], [category_id for category_id in category_ids if category_id])
+
+
+@receiver([m2m_changed], sender=TagProduct.goods.through)
+def invalidate_catalog_cache_tags(**kwargs) -> None:
+    """Сброс кэша каталога для товаров, у которых изменились теги"""
+    if kwargs.get('action') not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if kwargs.get('reverse'):
+        invalidate_catalog_for_products([kwargs.get('instance').pk])
+    elif pk_set := kwargs.get('pk_set'):
+        invalidate_catalog_for_products(pk_set)
+    else:
+        invalidate_catalog()
+
+
+@receiver([post_delete], sender=TagProduct)
+def invalidate_catalog_cache_tag(**kwargs) -> None:
+    """Сброс кэша каталога при удалении тега"""
+    invalidate_catalog()
+
+
+@receiver([post_save], sender=Product)
+def invalidate_product_page(**kwargs) -> None:
+    """Сброс снимка страницы товара после изменения товара"""
+    invalidate_product_pages([kwargs.get('instance').id])
+
+
+@receiver([post_delete], sender=Product)
+def invalidate_deleted_product_page(**kwargs) -> None:
+    invalidate_product_pages(slugs=[kwargs.get('instance').slug])
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=ProductShop)
+@receiver([post_save, post_delete], sender=Review)
+@receiver([post_save, post_delete], sender=FeatureToProduct)
+def invalidate_product_page_related(**kwargs) -> None:
+    """Сброс снимка страницы товара при изменении его изображений, предложений, отзывов или характеристик"""
+    invalidate_product_pages([kwargs.get('instance').product_id])
+
+
+@receiver([m2m_changed], sender=TagProduct.goods.through)
+def invalidate_product_page_tags(**kwargs) -> None:
+    """Сброс снимков страниц товаров, у которых изменились теги"""
+    action = kwargs.get('action')
+    if action in ('pre_clear', 'post_add', 'post_remove'):
+        instance = kwargs.get('instance')
+        if kwargs.get('reverse'):
+            invalidate_product_pages([instance.pk])
+        elif action == 'pre_clear':
+            invalidate_product_pages(list(instance.goods.values_list('id', flat=True)))
+        else:
+            invalidate_product_pages(kwargs.get('pk_set'))
+
+
+@receiver([m2m_changed], sender=FeatureToProduct.values.through)
+def invalidate_product_page_feature_values(**kwargs) -> None:
+    """Сброс снимков страниц товаров, у которых изменились значения характеристик"""
+    action = kwargs.get('action')
+    if action in ('pre_clear', 'post_add', 'post_remove'):
+        instance = kwargs.get('instance')
+        if not kwargs.get('reverse'):
+            invalidate_product_pages([instance.product_id])
+        elif action == 'pre_clear':
+            invalidate_product_pages(list(instance.to_shops.values_list('product_id', flat=True)))
+        else:
+            invalidate_product_pages(FeatureToProduct.objects.filter(id__in=kwargs.get('pk_set'))
+                                     .values_list('product_id', flat=True))
+
+
+@receiver([post_save, pre_delete], sender=TagProduct)
+def invalidate_product_page_tag(**kwargs) -> None:
+    """
+    Сброс снимков страниц товаров тега. При удалении товары выбираются до удаления связей,
+    сигналы об изменении которых не отправляются
+    """
+    invalidate_product_pages(list(kwargs.get('instance').goods.values_list('id', flat=True)))
+
+
+@receiver([post_save, pre_delete], sender=Discount)
+def invalidate_product_page_discount(**kwargs) -> None:
+    """Сброс снимков страниц товаров, на предложения которых действует скидка"""
+    instance: Discount = kwargs.get('instance')
+    invalidate_product_pages(list(ProductShop.objects.filter(discount=instance).values_list('product_id', flat=True)))
+
+
+@receiver([post_save], sender=Shop)
+def invalidate_product_page_shop(**kwargs) -> None:
+    """Сброс снимков страниц товаров, которые продает магазин"""
+    instance: Shop = kwargs.get('instance')
+    invalidate_product_pages(list(ProductShop.objects.filter(shop=instance).values_list('product_id', flat=True)))
+
+
+@receiver([post_save], sender=Category)
+def invalidate_product_page_category(**kwargs) -> None:
+    """Сброс снимков страниц товаров категории, название которой выводится на странице"""
+    invalidate_product_pages(list(kwargs.get('instance').products.values_list('id', flat=True)))
+
+
+@receiver([post_save], sender=FeatureName)
+def invalidate_product_page_feature_name(**kwargs) -> None:
+    invalidate_product_pages(list(FeatureToProduct.objects.filter(feature_name=kwargs.get('instance'))
+                                  .values_list('product_id', flat=True)))
+
+
+@receiver([post_save], sender=FeatureValue)
+def invalidate_product_page_feature_value(**kwargs) -> None:
+    invalidate_product_pages(list(kwargs.get('instance').to_shops.values_list('product_id', flat=True)))
+
+
+@receiver([post_save, post_delete], sender=FeatureToProduct)
+def invalidate_feature_matrix_feature(**kwargs) -> None:
+    """Сброс матрицы характеристик категории товара при добавлении или удалении его характеристики"""
+    instance: FeatureToProduct = kwargs.get('instance')
+    invalidate_feature_matrix(Product.objects.filter(id=instance.product_id).values_list('category_id', flat=True))
+
+
+@receiver([m2m_changed], sender=FeatureToProduct.values.through)
+def invalidate_feature_matrix_values(**kwargs) -> None:
+    """Сброс матриц характеристик категорий, в которых у товаров изменились значения характеристик"""
+    if kwargs.get('action') not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    instance = kwargs.get('instance')
+    if kwargs.get('reverse'):
+        products = Product.objects.filter(features__values=instance) if kwargs.get('action') == 'pre_clear' \
+            else Product.objects.filter(features__in=kwargs.get('pk_set'))
+    else:
+        products = Product.objects.filter(id=instance.product_id)
+    invalidate_feature_matrix(products.values_list('category_id', flat=True))
+
+
+@receiver([pre_delete], sender=FeatureValue)
+def invalidate_feature_matrix_value(**kwargs) -> None:
+    """Связи удаляемого значения с товарами удаляются без сигналов m2m_changed"""
+    invalidate_feature_matrix(Product.objects.filter(features__values=kwargs.get('instance'))
+                              .values_list('category_id', flat=True))
+
+
+@receiver([post_save], sender=Product)
+def invalidate_feature_matrix_product(**kwargs) -> None:
+    """
+    Рекомендованные характеристики нового товара создаются без сигналов, а характеристики товара,
+    перенесенного в другую категорию, меняют матрицы обеих категорий
+    """
+    instance: Product = kwargs.get('instance')
+    previous_category_id = getattr(instance, 'previous_category_id', None)
+    if kwargs.get('created') or previous_category_id != instance.category_id:
+        invalidate_feature_matrix([previous_category_id, instance.category_id])
+
+
+@receiver([m2m_changed], sender=FeatureToProduct.values.through)
+def update_feature_index_values(**kwargs) -> None:
+    """Сброс индекса характеристик категорий товаров и выдачи каталога с фильтрами по ним"""
+    action = kwargs.get('action')
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    instance = kwargs.get('instance')
+    if kwargs.get('reverse'):
+        products = Product.objects.filter(features__values=instance) if action == 'pre_clear' \
+            else Product.objects.filter(features__in=kwargs.get('pk_set'))
+        products = list(products.values_list('id', 'category_id'))
+        invalidate_feature_indexes([category_id for _, category_id in products])
+        invalidate_catalog_for_products([product_id for product_id, _ in products])
+        return
+    invalidate_feature_indexes(Product.objects.filter(id=instance.product_id).values_list('category_id', flat=True))
+    invalidate_catalog_for_products([instance.product_id])
+
+
+@receiver([pre_delete], sender=FeatureToProduct)
+def update_feature_index_feature(**kwargs) -> None:
+    """Значения удаляемой характеристики товара отвязываются без сигналов m2m_changed"""
+    instance: FeatureToProduct = kwargs.get('instance')
+    invalidate_feature_indexes(Product.objects.filter(id=instance.product_id).values_list('category_id', flat=True))
+
+
+@receiver([pre_delete], sender=FeatureValue)
+def invalidate_feature_index_value(**kwargs) -> None:
+    invalidate_feature_indexes(Product.objects.filter(features__values=kwargs.get('instance'))
+                               .values_list('category_id', flat=True))
+
+
+@receiver([post_save], sender=Product)
+def invalidate_feature_index_product(**kwargs) -> None:
+    """Товар, перенесенный в другую категорию, переходит в индекс новой категории"""
+    instance: Product = kwargs.get('instance')
+    previous_category_id = getattr(instance, 'previous_category_id', None)
+    if previous_category_id and previous_category_id != instance.category_id:
+        invalidate_feature_indexes([previous_category_id, instance.category_id])
@@ -1,16 +1,36 @@
+from datetime import timedelta
+
 from celery import shared_task
 from django.utils import timezone
 from django.utils.module_loading import import_string
 from djmoney import settings
 
-from .models.discount import Discount
+from django_marketplace.constants import DISCOUNT_SCHEDULE_HORIZON
+from .services.catalog_cache import invalidate_catalog_for_products
+from .services.checkout import release_expired_reservations
+from .services.discounts import switch_discounts as switch_discounts_service, get_discount_boundaries, \
+    invalidate_discount_caches
+from .services.home_sections import invalidate_home_sections, TOP_GOODS
+from .services.sales import flush_sales as flush_sales_service
+from .services.statistics import refresh_category_statistics as refresh_category_statistics_service
+
+
+@shared_task(name='switch_discounts')
+def switch_discounts():
+    """Переключение скидок на границе периода их действия: цены предложений и зависящие от скидок кэши"""
+    if discount_ids := switch_discounts_service():
+        invalidate_discount_caches(discount_ids)
 
 
-@shared_task(name='discount_invalidate')
-def discount_invalidate():
-    current_time = timezone.now()
-    discounts = Discount.objects.filter(date_end__lte=current_time, is_active=True)
-    discounts.update(is_active=False)
+@shared_task(name='schedule_discounts')
+def schedule_discounts():
+    """
+    Переключение пропущенных границ скидок и постановка задач точно на границы ближайшего периода.
+    Задачи ставятся не дальше чем на DISCOUNT_SCHEDULE_HORIZON, меньше таймаута видимости сообщений брокера
+    """
+    switch_discounts()
+    for boundary in get_discount_boundaries(timezone.now() + timedelta(seconds=DISCOUNT_SCHEDULE_HORIZON)):
+        switch_discounts.apply_async(eta=boundary)
 
 
 @shared_task(name='update_rates')
@@ -18,3 +38,23 @@ def update_rates(backend=settings.EXCHANGE_BACKEND, **kwargs):
     """Обновление курса валют"""
     backend = import_string(backend)()
     backend.update_rates(**kwargs)
+
+
+@shared_task(name='refresh_category_statistics')
+def refresh_category_statistics():
+    """Полный пересчет статистики категорий"""
+    refresh_category_statistics_service()
+
+
+@shared_task(name='flush_sales')
+def flush_sales():
+    """Перенос накопленных продаж в счетчики предложений и рейтинги самых продаваемых товаров"""
+    if product_ids := flush_sales_service():
+        invalidate_home_sections([TOP_GOODS])
+        invalidate_catalog_for_products(product_ids)
+
+
+@shared_task(name='release_order_reservations')
+def release_order_reservations():
+    """Отмена неоплаченных заказов с истекшим резервом и возврат товаров на склад"""
+    release_expired_reservations()
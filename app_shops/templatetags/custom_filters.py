@@ -3,9 +3,10 @@ from __future__ import annotations
 import decimal
 
 from django import template
-from djmoney.contrib.exchange.models import convert_money
 from djmoney.money import Money
 
+from app_shops.services.currency import convert_money
+
 register = template.Library()
 
 
@@ -22,4 +23,16 @@ def dollar_conversion(value) -> Money | None:
 
 @register.filter
 def dollar_conversion_range(value):
-    return int(dollar_conversion(value).amount)
+    converted = dollar_conversion(value)
+    return int(converted.amount) if converted is not None else ''
+
+
+@register.simple_tag(takes_context=True)
+def url_replace(context, **kwargs) -> str:
+    """Строка запроса текущей страницы с замененными параметрами. Параметры со значением None удаляются"""
+    query = context['request'].GET.copy()
+    for key, value in kwargs.items():
+        query.pop(key, None)
+        if value is not None:
+            query[key] = value
+    return query.urlencode()
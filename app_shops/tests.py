@@ -1,3 +1,423 @@
-from django.test import TestCase
+import datetime
+import threading
+import time
+import uuid
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from django_marketplace.constants import ORDER_RESERVATION_LIFETIME
+
+from .filters import ProductFilter
+from .models.category import Category
+from .models.discount import Discount
+from .models.order import Order, OrderItem
+from .models.product import FeatureName, FeatureToProduct, FeatureValue, Product, Review, TagProduct
+from .models.shop import ProductShop, Shop
+from .models.statistics import ProductStatistics
+from .services.catalog_cache import CATALOG_SCOPE_ALL, _get_version, get_cached_result, get_catalog_key, \
+    invalidate_catalog, invalidate_catalog_for_products, set_cached_result
+from .services.feature_index import filter_by_features, get_feature_indexes, get_feature_values
+from .services.checkout import OutOfStock, confirm_payment, place_order, release_expired_reservations
+from .services.discounts import update_effective_prices
+from .services.reference_cache import ReferenceCache
+from .services.statistics import refresh_product_statistics
+from .tasks import switch_discounts
+
+
+class ProductAggregatesTest(TestCase):
+    """
+    Агрегаты по предложениям и отзывам и фильтры каталога не должны размножать строки товаров
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name_ru='Телевизоры', name_en='TVs', is_active=True)
+        cls.product = Product.objects.create(name_ru='Телевизор', name_en='TV', description_short='short',
+                                             description_long='long', category=category, is_active=True)
+        cls.other_product = Product.objects.create(name_ru='Монитор', name_en='Monitor', description_short='short',
+                                                   description_long='long', category=category, is_active=True)
+        shops = [Shop.objects.create(name_ru=f'Магазин {index}', name_en=f'Shop {index}', description='shop',
+                                     phone=f'+7900000000{index}', mail=f'shop{index}@example.com',
+                                     address='address', is_active=True)
+                 for index in range(3)]
+
+        for shop, price, count_sold, count_left in zip(shops, (100, 200, 600), (1, 2, 3), (0, 5, 0)):
+            ProductShop.objects.create(product=cls.product, shop=shop, price=price, count_sold=count_sold,
+                                       count_left=count_left, is_active=True)
+        ProductShop.objects.create(product=cls.other_product, shop=shops[0], price=50, count_sold=7,
+                                   count_left=0, is_active=True)
+        ProductShop.objects.create(product=cls.other_product, shop=shops[1], price=1000, count_sold=100,
+                                   count_left=10, is_active=False)
+
+        for index in range(4):
+            profile = User.objects.create_user(username=f'user{index}', password='password').profile
+            Review.objects.create(product=cls.product, profile=profile, text='review', is_active=index != 3)
+
+        for codename in ('new', 'hit'):
+            tag = TagProduct.objects.create(name_ru=codename, name_en=codename)
+            tag.goods.add(cls.product, cls.other_product)
+        cls.tag = TagProduct.objects.get(name_en='hit')
+
+        refresh_product_statistics()
+
+    def test_offer_aggregates(self):
+        product = Product.objects.with_offer_aggregates().get(id=self.product.id)
+        self.assertEqual(product.avg_price, Decimal('300'))
+        self.assertEqual(product.min_price, Decimal('100'))
+        self.assertEqual(product.max_price, Decimal('600'))
+        self.assertEqual(product.count_sold, 6)
+        self.assertEqual(product.count_left, 5)
+        self.assertEqual(product.offers_count, 3)
+        self.assertEqual(product.feedback, 3)
+
+    def test_offer_aggregates_ignore_inactive_offers(self):
+        product = Product.objects.with_offer_aggregates().get(id=self.other_product.id)
+        self.assertEqual(product.count_sold, 7)
+        self.assertEqual(product.max_price, Decimal('50'))
+        self.assertEqual(product.feedback, 0)
+
+    def test_offer_aggregates_without_joins(self):
+        sql = str(Product.objects.with_offer_aggregates().with_tag(self.tag.codename).query)
+        self.assertNotIn('JOIN', sql)
+        self.assertIn('EXISTS', sql)
+
+    def test_statistics_match_aggregates(self):
+        statistics = self.product.statistics
+        self.assertEqual(statistics.count_sold, 6)
+        self.assertEqual(statistics.feedback, 3)
+        self.assertEqual(statistics.offers_count, 3)
+        self.assertTrue(statistics.in_stock)
+        self.assertFalse(self.other_product.statistics.in_stock)
+
+    def test_filter_visits_each_product_once(self):
+        request = RequestFactory().get('/catalog/', {'tag': self.tag.codename, 'in_stock': 'on',
+                                                     'order_by': '-feedback'})
+        request.LANGUAGE_CODE = 'ru'
+        queryset = Product.objects.filter(is_active=True, statistics__offers_count__gt=0) \
+            .with_offer_aggregates()
+        filterset = ProductFilter(request.GET, queryset, request=request)
+
+        with CaptureQueriesContext(connection) as context:
+            products = list(filterset.qs)
+        joined_tables = [part.split()[0] for part in context.captured_queries[0]['sql'].split(' JOIN ')[1:]]
+        self.assertEqual(len(joined_tables), len(set(joined_tables)))
+        self.assertEqual(joined_tables, ['"app_shops_productstatistics"'])
+
+        self.assertEqual(products, [self.product])
+        self.assertEqual(products[0].count_sold, 6)
+        self.assertEqual(products[0].feedback, 3)
+
+
+class CheckoutConcurrencyTest(TransactionTestCase):
+    """
+    Параллельные заказы одного предложения не должны продавать больше остатка
+    и создавать несколько заказов на одну отправку формы
+    """
+    STOCK = 5
+    PRICE = Decimal('100.00')
+
+    def setUp(self):
+        category = Category.objects.create(name_ru='Телевизоры', name_en='TVs', is_active=True)
+        product = Product.objects.create(name_ru='Телевизор', name_en='TV', description_short='short',
+                                         description_long='long', category=category, is_active=True)
+        shop = Shop.objects.create(name_ru='Магазин', name_en='Shop', description='shop', phone='+79000000000',
+                                   mail='shop@example.com', address='address', is_active=True)
+        self.offer = ProductShop.objects.create(product=product, shop=shop, price=self.PRICE,
+                                                count_left=self.STOCK, is_active=True)
+        self.product = product
+
+    def _place_orders(self, threads_count, submission_key=None):
+        results = []
+        barrier = threading.Barrier(threads_count)
+
+        def place():
+            try:
+                barrier.wait()
+                results.append(place_order(submission_key or uuid.uuid4(), [(self.offer.id, 1, self.PRICE)]))
+            except OutOfStock:
+                results.append(None)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=place) for _ in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_stock_is_never_oversold(self):
+        results = self._place_orders(20)
+        self.assertEqual(len(results), 20)
+        self.assertEqual(len([order for order in results if order]), self.STOCK)
+        self.offer.refresh_from_db()
+        self.assertEqual(self.offer.count_left, 0)
+        self.assertEqual(OrderItem.objects.count(), self.STOCK)
+
+    def test_same_submission_key_places_one_order(self):
+        results = self._place_orders(10, submission_key=uuid.uuid4())
+        self.assertEqual(len({order.id for order in results}), 1)
+        self.assertEqual(Order.objects.count(), 1)
+        self.offer.refresh_from_db()
+        self.assertEqual(self.offer.count_left, self.STOCK - 1)
+
+    def test_oversold_order_changes_nothing(self):
+        with self.assertRaises(OutOfStock) as context:
+            place_order(uuid.uuid4(), [(self.offer.id, self.STOCK + 1, self.PRICE)])
+        self.assertEqual(context.exception.offer_ids, [self.offer.id])
+        self.assertFalse(Order.objects.exists())
+        self.offer.refresh_from_db()
+        self.assertEqual(self.offer.count_left, self.STOCK)
+
+    def test_expired_reservation_returns_stock(self):
+        order = place_order(uuid.uuid4(), [(self.offer.id, 2, self.PRICE)])
+        expired = timezone.now() + datetime.timedelta(seconds=ORDER_RESERVATION_LIFETIME + 1)
+        self.assertEqual(release_expired_reservations(expired), [order.id])
+        self.offer.refresh_from_db()
+        self.assertEqual(self.offer.count_left, self.STOCK)
+        self.assertEqual(confirm_payment([order.id]), [])
+
+    def test_stock_changes_refresh_statistics_and_catalog(self):
+        version = _get_version(CATALOG_SCOPE_ALL)
+        order = place_order(uuid.uuid4(), [(self.offer.id, self.STOCK, self.PRICE)])
+        self.assertFalse(ProductStatistics.objects.get(product=self.product).in_stock)
+        self.assertNotEqual(_get_version(CATALOG_SCOPE_ALL), version)
+
+        version = _get_version(CATALOG_SCOPE_ALL)
+        expired = timezone.now() + datetime.timedelta(seconds=ORDER_RESERVATION_LIFETIME + 1)
+        self.assertEqual(release_expired_reservations(expired), [order.id])
+        self.assertTrue(ProductStatistics.objects.get(product=self.product).in_stock)
+        self.assertNotEqual(_get_version(CATALOG_SCOPE_ALL), version)
+
+
+class DiscountSwitchTest(TransactionTestCase):
+    """
+    Переключение скидки меняет цены со скидкой, статистику товаров и сбрасывает результаты каталога
+    """
+
+    def setUp(self):
+        category = Category.objects.create(name_ru='Телевизоры', name_en='TVs', is_active=True)
+        self.product = Product.objects.create(name_ru='Телевизор', name_en='TV', description_short='short',
+                                              description_long='long', category=category, is_active=True)
+        shop = Shop.objects.create(name_ru='Магазин', name_en='Shop', description='shop', phone='+79000000000',
+                                   mail='shop@example.com', address='address', is_active=True)
+        discount = Discount.objects.create(name_ru='Скидка', name_en='Sale', description_short='short',
+                                           description_long='long', shop=shop, discount_percentage=10,
+                                           date_start=timezone.now() - datetime.timedelta(days=1))
+        self.offer = ProductShop.objects.create(product=self.product, shop=shop, price=100, discount=discount,
+                                                count_left=5, is_active=True)
+        # Скидка, начало которой наступило, но которая еще не применена к ценам
+        Discount.objects.filter(id=discount.id).update(is_applied=False)
+        ProductShop.objects.filter(id=self.offer.id).update(effective_price=F('price'))
+        refresh_product_statistics([self.product.id])
+
+    def test_switch_refreshes_statistics_and_catalog(self):
+        catalog_key = get_catalog_key({'order_by': 'price'}, None, 'ru')
+        self.assertEqual(ProductStatistics.objects.get(product=self.product).avg_effective_price, Decimal('100'))
+
+        switch_discounts()
+
+        self.offer.refresh_from_db()
+        self.assertEqual(self.offer.effective_price, Decimal('90'))
+        self.assertEqual(ProductStatistics.objects.get(product=self.product).avg_effective_price, Decimal('90'))
+        self.assertNotEqual(get_catalog_key({'order_by': 'price'}, None, 'ru'), catalog_key)
+
+
+# Индексы прежних запусков лежат в общем файловом кэше под id, которые тестовая база выдает заново
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class FeatureIndexTest(TestCase):
+    """
+    Фильтр по характеристикам на битовых картах индекса: значения одной характеристики по ИЛИ, разных - по И
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name_ru='Телевизоры', name_en='TVs', is_active=True)
+        cls.products = [Product.objects.create(name_ru=f'Телевизор {index}', name_en=f'TV {index}',
+                                               description_short='short', description_long='long',
+                                               category=cls.category, is_active=True)
+                        for index in range(3)]
+        resolution = FeatureName.objects.create(name_ru='Разрешение', name_en='Resolution')
+        port = FeatureName.objects.create(name_ru='Разъем', name_en='Port')
+        cls.uhd, cls.full_hd = [FeatureValue.objects.create(name=resolution, value_ru=value, value_en=value)
+                                for value in ('4K', 'Full HD')]
+        cls.hdmi = FeatureValue.objects.create(name=port, value_ru='HDMI', value_en='HDMI')
+        for product, values in zip(cls.products, ([cls.uhd, cls.hdmi], [cls.uhd], [cls.full_hd])):
+            for value in values:
+                FeatureToProduct.objects.get_or_create(product=product, feature_name=value.name)[0].values.add(value)
+
+    def setUp(self):
+        cache.clear()
+
+    def _filter(self, *values):
+        return sorted(filter_by_features([value.id for value in values], [self.category.id]))
+
+    def test_filter_by_features(self):
+        first, second, third = [product.id for product in self.products]
+        self.assertEqual(self._filter(self.uhd), [first, second])
+        self.assertEqual(self._filter(self.uhd, self.full_hd), [first, second, third])
+        self.assertEqual(self._filter(self.uhd, self.hdmi), [first])
+        self.assertEqual(self._filter(self.full_hd, self.hdmi), [])
+
+    def test_bitmaps_use_product_ordinals(self):
+        index = get_feature_indexes([self.category.id])[self.category.id]
+        self.assertEqual(index['products'], sorted(product.id for product in self.products))
+        self.assertTrue(all(bitmap < 1 << len(self.products) for bitmap in index['bitmaps'].values()))
+        counts = {value['id']: value['count'] for feature in get_feature_values([self.category.id])
+                  for value in feature['values']}
+        self.assertEqual(counts, {self.uhd.id: 2, self.full_hd.id: 1, self.hdmi.id: 1})
+
+    def test_index_is_rebuilt_after_values_change(self):
+        self._filter(self.hdmi)
+        with self.captureOnCommitCallbacks(execute=True):
+            FeatureToProduct.objects.create(product=self.products[2], feature_name=self.hdmi.name) \
+                .values.add(self.hdmi)
+        self.assertEqual(self._filter(self.hdmi), [self.products[0].id, self.products[2].id])
+
+
+class EffectivePriceTest(TestCase):
+    """
+    Цены со скидкой хранятся в предложениях, а каталог сортирует товары по статистике этих цен
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name_ru='Телевизоры', name_en='TVs', is_active=True)
+        shop = Shop.objects.create(name_ru='Магазин', name_en='Shop', description='shop', phone='+79000000000',
+                                   mail='shop@example.com', address='address', is_active=True)
+        cls.discount = Discount.objects.create(name_ru='Скидка', name_en='Sale', description_short='short',
+                                               description_long='long', shop=shop, discount_percentage=50,
+                                               date_start=timezone.now() - datetime.timedelta(days=1))
+        cls.products = [Product.objects.create(name_ru=f'Телевизор {index}', name_en=f'TV {index}',
+                                               description_short='short', description_long='long',
+                                               category=category, is_active=True)
+                        for index in range(3)]
+        cls.offers = [ProductShop.objects.create(product=product, shop=shop, price=price, discount=discount,
+                                                 count_left=1, is_active=True)
+                      for product, price, discount in zip(cls.products, (100, 80, Decimal('10.05')),
+                                                          (cls.discount, None, cls.discount))]
+        refresh_product_statistics()
+
+    def _effective_prices(self):
+        return [ProductShop.objects.get(id=offer.id).effective_price for offer in self.offers]
+
+    def test_effective_price_rounds_half_up(self):
+        self.assertEqual(self._effective_prices(), [Decimal('50'), Decimal('80'), Decimal('5.03')])
+        update_effective_prices([self.discount.id])
+        self.assertEqual(self._effective_prices(), [Decimal('50'), Decimal('80'), Decimal('5.03')])
+
+    def test_catalog_sorts_by_selling_price(self):
+        request = RequestFactory().get('/catalog/', {'order_by': 'avg_price'})
+        request.LANGUAGE_CODE = 'ru'
+        queryset = Product.objects.annotate(avg_price=F('statistics__avg_effective_price'),
+                                            avg_price_usd=F('statistics__avg_effective_price_usd'))
+        products = list(ProductFilter(request.GET, queryset, request=request).qs)
+        self.assertEqual(products, [self.products[2], self.products[0], self.products[1]])
+
+    def test_discount_change_refreshes_statistics(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.discount.discount_percentage = 10
+            self.discount.save()
+        self.assertEqual(self._effective_prices(), [Decimal('90'), Decimal('80'), Decimal('9.05')])
+        self.assertEqual(ProductStatistics.objects.get(product=self.products[0]).avg_effective_price, Decimal('90'))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CatalogCacheTest(TestCase):
+    """
+    Ключ результата каталога не зависит от порядка и регистра параметров, а изменение товара
+    сбрасывает результаты только его категорий, их предков и каталога без фильтра по категории
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.parent = Category.objects.create(name_ru='Электроника', name_en='Electronics', is_active=True)
+        cls.child = Category.objects.create(name_ru='Телевизоры', name_en='TVs', parent=cls.parent, is_active=True)
+        cls.other = Category.objects.create(name_ru='Книги', name_en='Books', is_active=True)
+        cls.product = Product.objects.create(name_ru='Телевизор', name_en='TV', description_short='short',
+                                             description_long='long', category=cls.child, is_active=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def _keys(self):
+        return {category: get_catalog_key({'order_by': 'count_sold'}, category, 'ru')
+                for category in (None, self.parent.slug, self.child.slug, self.other.slug)}
+
+    def test_key_is_normalized(self):
+        self.assertEqual(get_catalog_key({'name': ' Smart  TV', 'tag': '', 'order_by': 'count_sold'}, None, 'ru'),
+                         get_catalog_key({'order_by': 'count_sold', 'name': 'smart tv', 'tag': None}, None, 'ru'))
+        self.assertNotEqual(get_catalog_key({'name': 'tv'}, None, 'ru'), get_catalog_key({'name': 'tv'}, None, 'en'))
+
+    def test_product_change_invalidates_its_categories(self):
+        keys = self._keys()
+        set_cached_result(keys[self.other.slug], [self.product.id], {})
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate_catalog_for_products([self.product.id])
+        new_keys = self._keys()
+        for category in (None, self.parent.slug, self.child.slug):
+            self.assertNotEqual(new_keys[category], keys[category])
+        self.assertEqual(new_keys[self.other.slug], keys[self.other.slug])
+        self.assertEqual(get_cached_result(keys[self.other.slug])['ids'], [self.product.id])
+
+    def test_global_invalidation(self):
+        keys = self._keys()
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate_catalog()
+        self.assertTrue(all(new_key != keys[category] for category, new_key in self._keys().items()))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ReferenceCacheTest(TestCase):
+    """
+    Справочное значение строится один раз для всех потоков и процессов и перестраивается после сброса
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.builds = 0
+
+    def _build(self):
+        self.builds += 1
+        time.sleep(0.05)
+        return self.builds
+
+    def test_value_is_built_once(self):
+        first, second = ReferenceCache(), ReferenceCache()
+        self.assertEqual(first.get('menu', self._build, 60), 1)
+        self.assertEqual(first.get('menu', self._build, 60), 1)
+        # Другой процесс читает значение из общего кэша
+        self.assertEqual(second.get('menu', self._build, 60), 1)
+        self.assertEqual(self.builds, 1)
+
+    def test_concurrent_requests_build_once(self):
+        reference_cache, results = ReferenceCache(), []
+        barrier = threading.Barrier(10)
+
+        def get():
+            barrier.wait()
+            results.append(reference_cache.get('menu', self._build, 60))
+
+        threads = [threading.Thread(target=get) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [1] * 10)
+        self.assertEqual(self.builds, 1)
+
+    def test_invalidation_reaches_other_processes(self):
+        first, second = ReferenceCache(recheck_interval=0), ReferenceCache(recheck_interval=0)
+        self.assertEqual(first.get('menu', self._build, 60), 1)
+        self.assertEqual(second.get('menu', self._build, 60), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            first.invalidate('menu')
+        self.assertEqual(second.get('menu', self._build, 60), 2)
+        self.assertEqual(first.get('menu', self._build, 60), 2)
@@ -1,6 +1,7 @@
 from django.urls import path
 from .views import HomeView, CatalogView, ClearCache, SaleView, \
-DiscountDetailView, ProductDetailView, ComparisonView, OrderView
+DiscountDetailView, ProductDetailView, ProductReviewsView, ComparisonView, OrderView, \
+OrderHistoryView, OrderDetailView
 
 urlpatterns = [
     path('', HomeView.as_view(), name='home'),
@@ -9,6 +10,9 @@ urlpatterns = [
     path('promo/', SaleView.as_view(), name='sales'),
     path('promo/<slug:promo_slug>/', DiscountDetailView.as_view(), name='discount'),
     path('product/<slug:product_slug>/', ProductDetailView.as_view(), name='product-detail'),
+    path('product/<slug:product_slug>/reviews/', ProductReviewsView.as_view(), name='product-reviews'),
     path('catalog/compare/', ComparisonView.as_view(), name='comparison'),
     path('order/checkout/', OrderView.as_view(), name='order'),
+    path('order/history/', OrderHistoryView.as_view(), name='order-history'),
+    path('order/<int:pk>/', OrderDetailView.as_view(), name='order-detail'),
 ]
@@ -1,29 +1,44 @@
-from collections import defaultdict
+import copy
+import uuid
+from typing import List
 
 from django.contrib import messages
-from django.contrib.postgres.aggregates import ArrayAgg
+from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.cache import cache
 from django.core.paginator import Paginator
-from django.db.models import QuerySet, Avg, Min, Max, Sum, Prefetch, Count
-from django.http import HttpRequest, HttpResponse
-from django.shortcuts import redirect
-from django.utils import timezone
+from django.db.models import QuerySet, Prefetch, F
+from django.http import HttpRequest, HttpResponse, Http404
+from django.shortcuts import redirect, render
 from django.utils.translation import gettext_lazy as _
 from django.views import View
 from django.views.generic import TemplateView, ListView, DetailView, CreateView
 from django_filters.views import FilterView
-from djmoney.contrib.exchange.models import convert_money
-from djmoney.money import Money
 
-from django_marketplace.constants import SORT_OPTIONS_CACHE_LIFETIME, TAGS_CACHE_LIFETIME, SALES_CACHE_LIFETIME
+from django_marketplace.constants import SORT_OPTIONS_CACHE_LIFETIME, TAGS_CACHE_LIFETIME, SALES_CACHE_LIFETIME, \
+    CATALOG_CACHE_MAX_IDS
 from .filters import ProductFilter
 from .forms import OrderForm1, OrderForm2, OrderForm3, ReviewForm
-from .models.banner import Banner, SpecialOffer, SmallBanner
+from .models.category import Category
 from .models.discount import Discount
+from .models.order import DeliveryCategory, PaymentCategory
 from .models.product import SortProduct, Product, TagProduct, FeatureToProduct, Review
 from .models.shop import ProductShop
+from .services.catalog_cache import get_catalog_key, get_cached_result, set_cached_result, hydrate_products, \
+    invalidate_catalog
+from .services.checkout import EmptyOrder, OutOfStock, place_order
+from .services.currency import convert_amount
+from .services.facets import get_catalog_facets
+from .services.feature_index import get_feature_values
+from .services.feature_matrix import compare_features
+from .services.home_sections import get_home_sections, TOP_GOODS, BANNERS, SMALL_BANNERS, SPECIAL_OFFER
+from .services.orders import get_buyer_orders, get_orders_page
+from .services.product_page import get_product_snapshot
+from .services.reference_cache import get_reference, invalidate_reference
+from .services.reviews import get_reviews_page
+from .services.pagination import paginate, get_keyset_ordering, order_by_keyset, CURSOR_PARAM
+from .services.statistics import get_price_bounds
+from app_cart.cart import Cart
 from app_cart.forms import CartAddProductForm
-from random import sample
 
 
 class HomeView(TemplateView):
@@ -34,21 +49,16 @@ class HomeView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        goods = Product.objects.select_related('category', 'main_image') \
-                .prefetch_related(Prefetch('in_shops', queryset=ProductShop.objects.select_related('shop')))
-        top_products = goods.order_by('-in_shops__count_sold')[:8].annotate(avg_price=Avg('in_shops__price'))
+        sections = get_home_sections()
 
-        banners = Banner.objects.filter(is_active=True)[:3].select_related('product')
+        if product_with_timer := sections[SPECIAL_OFFER]:
+            context['product_with_timer'] = product_with_timer
+            if product_with_timer['date_end']:
+                context['date_end'] = product_with_timer['date_end'].strftime('%d.%m.%Y %H:%M')
 
-        small_banners = SmallBanner.objects.all()[:3].select_related('product').annotate(price_from=Min('product__in_shops__price'))
-        if product_with_timer := SpecialOffer.objects.all().first():
-            context['product_with_timer'] = ProductShop.objects.with_discount_price() \
-                    .get(id=product_with_timer.product_shop_id)
-            context['date_end'] = product_with_timer.date_end.strftime('%d.%m.%Y %H:%M')
-
-        context['top_goods'] = top_products
-        context['banners'] = banners
-        context['small_banners'] = small_banners
+        context['top_goods'] = sections[TOP_GOODS]
+        context['banners'] = sections[BANNERS]
+        context['small_banners'] = sections[SMALL_BANNERS]
 
         return context
 
@@ -63,8 +73,10 @@ class CatalogView(FilterView):
 
     def __init__(self, **kwargs) -> None:
         super().__init__(**kwargs)
-        self.sort_options: QuerySet = cache.get_or_set('sort_options', SortProduct.objects.all(),
-                                                       timeout=SORT_OPTIONS_CACHE_LIFETIME)
+        # Копии: sorting_update меняет варианты сортировки, а закэшированные объекты общие для всех запросов процесса
+        self.sort_options: List[SortProduct] = [
+            copy.copy(option) for option in get_reference('sort_options', lambda: list(SortProduct.objects.all()),
+                                                          timeout=SORT_OPTIONS_CACHE_LIFETIME)]
 
     def get_paginate_by(self, queryset):
         self.paginate_by = 8
@@ -74,17 +86,60 @@ class CatalogView(FilterView):
             self.paginate_by = 6
         return self.paginate_by
 
+    def paginate_queryset(self, queryset, page_size):
+        ids = self.get_catalog_result()['ids']
+        if ids is None or CURSOR_PARAM in self.request.GET:
+            paginator, page = paginate(queryset, page_size, self.request)
+        else:
+            paginator = Paginator(ids, page_size)
+            page = paginator.get_page(self.request.GET.get('page'))
+            page.object_list = hydrate_products(self.queryset, page.object_list)
+            page.next_cursor = page.previous_cursor = None
+        return paginator, page, page.object_list, page.has_other_pages() or bool(page.next_cursor)
+
+    def get_catalog_result(self) -> dict:
+        """
+        Результат каталога для текущих параметров фильтра: упорядоченный список id товаров и фасеты.
+        Берется из кэша, при промахе вычисляется и сохраняется
+        """
+        if hasattr(self, 'catalog_result'):
+            return self.catalog_result
+
+        key = None
+        if self.filterset.is_valid():
+            key = get_catalog_key(self.filterset.form.cleaned_data, self.request.GET.get('category'),
+                                  self.request.LANGUAGE_CODE)
+            if result := get_cached_result(key):
+                self.catalog_result = result
+                return result
+
+        ordered = order_by_keyset(self.object_list, get_keyset_ordering(self.object_list))
+        ids = list(ordered.values_list('id', flat=True)[:CATALOG_CACHE_MAX_IDS + 1])
+        if len(ids) > CATALOG_CACHE_MAX_IDS:
+            ids = None
+        facets = get_catalog_facets(self.filterset.facet_queryset())
+        self.catalog_result = set_cached_result(key, ids, facets) if key else {'ids': ids, 'facets': facets}
+        return self.catalog_result
+
     def get_queryset(self):
-        filter_options = {'is_active': True, 'in_shops__is_active': True}
+        filter_options = {'is_active': True, 'statistics__offers_count__gt': 0}
+        self.selected_category = None
         if category := self.request.GET.get('category'):
-            filter_options['category__slug'] = category
+            self.selected_category = Category.objects.filter(slug=category).first()
+            if self.selected_category and self.selected_category.tree_path:
+                # Категория вместе со всеми подкатегориями: поиск по префиксу материализованного пути
+                filter_options['category__tree_path__startswith'] = self.selected_category.tree_path
+            else:
+                filter_options['category__slug'] = category
+        # Цены в выдаче - цены продажи со скидкой: по ним каталог сортирует и фильтрует товары
         self.queryset = Product.objects.filter(**filter_options) \
             .select_related('category', 'main_image') \
-            .annotate(avg_price=Avg('in_shops__price'),
-                      min_price=Min('in_shops__price'),
-                      max_price=Max('in_shops__price'),
-                      count_sold=Sum('in_shops__count_sold'),
-                      feedback=Count('reviews'))
+            .annotate(avg_price=F('statistics__avg_effective_price'),
+                      avg_price_usd=F('statistics__avg_effective_price_usd'),
+                      min_price=F('statistics__min_effective_price'),
+                      max_price=F('statistics__max_price'),
+                      count_sold=F('statistics__count_sold'),
+                      feedback=F('statistics__feedback'))
         return self.queryset
 
     def sorting_update(self) -> None:
@@ -109,9 +164,17 @@ class CatalogView(FilterView):
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data(object_list=None, **kwargs)
-        aggregate: dict = self.queryset.aggregate(min=Min('min_price'), max=Max('max_price'))
-        min_price = aggregate.get('min')
-        max_price = aggregate.get('max')
+        facets = self.get_catalog_result()['facets']
+        category = self.request.GET.get('category')
+        bounds = get_price_bounds(category)
+        min_price, max_price = bounds['min_price'], bounds['max_price']
+        min_price_usd, max_price_usd = bounds['min_price_usd'], bounds['max_price_usd']
+        if min_price is None:
+            # Статистика категорий еще не построена
+            min_price, max_price = facets['min_price'], facets['max_price']
+        if min_price is not None and min_price_usd is None:
+            min_price_usd = convert_amount(min_price, 'RUB', 'USD')
+            max_price_usd = convert_amount(max_price, 'RUB', 'USD')
 
         self.ordering = self.filterset.data.get('order_by') or 'count_sold'
         self.sorting_update()
@@ -122,22 +185,45 @@ class CatalogView(FilterView):
         elif self.request.LANGUAGE_CODE == 'ru':
             price_from, price_to = min_price, max_price
         else:
-            price_from = convert_money(Money(min_price, 'RUB'), 'USD').amount
-            price_to = convert_money(Money(max_price, 'RUB'), 'USD').amount
-        category = self.request.GET.get('category')
+            price_from, price_to = min_price_usd, max_price_usd
 
         context['sort_options'] = self.sort_options
-        context['tags'] = cache.get_or_set('tags', TagProduct.objects.all(), timeout=TAGS_CACHE_LIFETIME)
+        context['tags'] = self.get_tags_with_counts(facets['tags'])
+        context['category_counts'] = facets['categories']
+        context['in_stock_count'] = facets['in_stock']
+        context['price_histogram'] = facets['price_histogram']
         context['order_by'] = self.ordering
         context['category'] = category or ''
+        context['category_path'] = [*self.selected_category.get_ancestors(), self.selected_category] \
+            if self.selected_category else []
         context['price_from'] = price_from
         context['price_to'] = price_to
         context['min_price'] = min_price
         context['max_price'] = max_price
+        context['min_price_usd'] = min_price_usd
+        context['max_price_usd'] = max_price_usd
         context['form'] = self.filterset.form
+        if self.selected_category:
+            # Фильтр по характеристикам доступен внутри категории, где у товаров общий набор характеристик
+            context['features'] = get_feature_values(self.selected_category.get_descendants()
+                                                     .values_list('id', flat=True))
+            context['selected_features'] = {int(value_id) for value_id in
+                                            (self.filterset.data.get('feature') or '').split(',') if value_id}
 
         return context
 
+    @staticmethod
+    def get_tags_with_counts(tag_counts) -> list:
+        """Теги, встречающиеся в выдаче, с количеством товаров, по убыванию количества"""
+        tags = get_reference('tags', lambda: list(TagProduct.objects.all()), timeout=TAGS_CACHE_LIFETIME)
+        result = []
+        for tag in tags:
+            if tag_counts.get(tag.id):
+                tag = copy.copy(tag)
+                tag.products_count = tag_counts[tag.id]
+                result.append(tag)
+        return sorted(result, key=lambda item: item.products_count, reverse=True)
+
 
 class SaleView(ListView):
     """
@@ -147,10 +233,9 @@ class SaleView(ListView):
     context_object_name = 'sales'
 
     def get_queryset(self):
-        self.queryset = cache.get_or_set('sales', Discount.objects.filter(is_active=True,
-                                                                          date_start__lte=timezone.now())
-                                         .select_related('main_image'),
-                                         timeout=SALES_CACHE_LIFETIME)
+        self.queryset = get_reference('sales',
+                                      lambda: list(Discount.objects.filter(is_applied=True).select_related('main_image')),
+                                      timeout=SALES_CACHE_LIFETIME)
         return self.queryset
 
     def get_paginate_by(self, queryset):
@@ -170,7 +255,7 @@ class DiscountDetailView(DetailView):
 
     def get(self, request, *args, **kwargs):
         self.object: Discount = self.get_object()
-        if not self.object.is_active or self.object.date_start > timezone.now():
+        if not self.object.is_applied:
             return redirect('sales')
         context = self.get_context_data(object=self.object)
         return self.render_to_response(context)
@@ -192,9 +277,7 @@ class DiscountDetailView(DetailView):
         elif self.request.user_agent.is_tablet:
             paginate_by = 6
 
-        paginator = Paginator(goods, paginate_by)
-        page_number = self.request.GET.get('page')
-        page_obj = paginator.get_page(page_number)
+        paginator, page_obj = paginate(goods, paginate_by, self.request)
         context['page_obj'] = page_obj
         return context
 
@@ -205,11 +288,11 @@ class ClearCache(View):
             raise PermissionError
 
         if 'product_cache' in request.POST:
-            cache.delete('sort_options')
-            cache.delete('tags')
+            invalidate_reference('sort_options', 'tags')
+            invalidate_catalog()
             messages.success(self.request, _('Cache cleared successfully'))
         elif 'categories_cache' in request.POST:
-            cache.delete('categories')
+            invalidate_reference('categories')
             messages.success(self.request, _('Cache cleared successfully'))
         elif 'all_cache' in request.POST:
             cache.clear()
@@ -220,41 +303,37 @@ class ClearCache(View):
         return redirect(request.META.get('HTTP_REFERER'))
 
 
+def get_product_snapshot_or_404(slug: str) -> dict:
+    snapshot = get_product_snapshot(slug)
+    if snapshot is None:
+        raise Http404(_('No %(verbose_name)s found matching the query') % {'verbose_name': Product._meta.verbose_name})
+    return snapshot
+
+
 class ProductDetailView(DetailView):
     """
-    Представление детальной страницы товара
+    Представление детальной страницы товара.
+    Страница строится по снимку из кэша, запросом к базе читаются только отзывы
     """
     model = Product
     slug_url_kwarg = 'product_slug'
     template_name = 'pages/product.html'
     context_object_name = 'product'
 
-    def get_queryset(self):
-        queryset = super().get_queryset()
-        queryset = queryset.select_related('category', 'main_image'). \
-            prefetch_related('images', 'tags',
-                             Prefetch('features', queryset=FeatureToProduct.objects.select_related('feature_name')
-                                      .prefetch_related('values')),
-                             Prefetch('in_shops', queryset=ProductShop.objects.select_related('shop')),
-                             Prefetch('reviews', queryset=Review.objects.select_related('profile')))
-
-        return queryset
+    def get_object(self, queryset=None):
+        return get_product_snapshot_or_404(self.kwargs.get(self.slug_url_kwarg))
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        product: Product = context['product']
-        discounts_query = ProductShop.objects.with_discount_price().select_related('shop').filter(product=product)
-        reviews_count = product.reviews.count()
-        shop_prices, price = self.get_prices(discounts_query)
-        cart_product_form = CartAddProductForm()
+        product = context['product']
 
         context['review_form'] = ReviewForm
-        context['price'] = price
-        context['sellers'] = shop_prices
-        context['reviews_count'] = reviews_count
-        context['cart_product_form'] = cart_product_form
-        context['random_product_id'] = sample(list(product.in_shops.filter(is_active=True)), 1)[0].id
-        
+        context['price'] = product['price']
+        context['sellers'] = product['sellers']
+        context['reviews_count'] = product['reviews_count']
+        context['reviews'] = get_reviews_page(product['id'])
+        context['cart_product_form'] = CartAddProductForm()
+        context['default_offer_id'] = product['default_offer_id']
 
         return context
 
@@ -266,23 +345,20 @@ class ProductDetailView(DetailView):
         profile = request.user.profile
         form = ReviewForm(request.POST)
         if form.is_valid():
-            review = Review(product=product, profile=profile, text=form.cleaned_data.get('text'))
+            review = Review(product_id=product['id'], profile=profile, text=form.cleaned_data.get('text'))
             review.save()
-        return redirect('product-detail', product_slug=product.slug)
+        return redirect('product-detail', product_slug=product['slug'])
 
-    @staticmethod
-    def get_prices(discounts_query):
-        shop_prices = {product_shop.shop: {'price_old': product_shop.price.amount}
-                       if not product_shop.discount_price
-                       else {'price_old': product_shop.price.amount, 'price_new': product_shop.discount_price}
-                       for product_shop in discounts_query}
-        price_list = [price.get('price_new') if price.get('price_new') else price.get('price_old')
-                      for price in shop_prices.values()]
 
-        price = float(sum([float(price) if not isinstance(price, Money) else float(price.amount)
-                           for price in price_list]) / len(price_list))
+class ProductReviewsView(View):
+    """
+    Следующая страница отзывов товара для подгрузки на странице товара
+    """
 
-        return shop_prices, price
+    def get(self, request: HttpRequest, product_slug: str) -> HttpResponse:
+        product = get_product_snapshot_or_404(product_slug)
+        reviews = get_reviews_page(product['id'], request.GET.get(CURSOR_PARAM))
+        return render(request, 'components/reviews.html', {'product': product, 'reviews': reviews})
 
 
 class OrderView(TemplateView):
@@ -294,14 +370,71 @@ class OrderView(TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        context['form1'] = OrderForm1
-        context['form2'] = OrderForm2
-        context['form3'] = OrderForm3
+        context.setdefault('form1', OrderForm1)
+        context.setdefault('form2', OrderForm2)
+        context.setdefault('form3', OrderForm3)
+        context['cart'] = Cart(self.request)
+        # Ключ отправки формы: повторная отправка той же страницы не создает второй заказ
+        context.setdefault('submission_key', uuid.uuid4())
         return context
 
     def post(self, request: HttpRequest) -> HttpResponse:
-        print(request.POST)
-        return redirect('order')
+        delivery = DeliveryCategory.objects.filter(is_active=True, codename=request.POST.get('delivery')).first()
+        payment = PaymentCategory.objects.filter(is_active=True, codename=request.POST.get('pay')).first()
+        form1 = OrderForm1(request.POST)
+        form2 = OrderForm2({**request.POST.dict(), 'category': delivery and delivery.pk})
+        form3 = OrderForm3({'category': payment and payment.pk})
+        try:
+            submission_key = uuid.UUID(request.POST.get('submission_key'))
+        except (TypeError, ValueError):
+            return redirect('order')
+        context = {'form1': form1, 'form2': form2, 'form3': form3, 'submission_key': submission_key}
+        if not all(form.is_valid() for form in (form1, form2, form3)):
+            return self.render_to_response(self.get_context_data(**context))
+
+        cart = Cart(request)
+        try:
+            order = place_order(submission_key,
+                                [(line.product.id, line.quantity, line.price) for line in cart],
+                                buyer=request.user if request.user.is_authenticated else None,
+                                delivery={'category': delivery, 'city': form2.cleaned_data['city'],
+                                          'address': form2.cleaned_data['address']},
+                                payment={'category': payment},
+                                comment='', **form1.cleaned_data)
+        except EmptyOrder:
+            return redirect('cart_detail')
+        except OutOfStock as error:
+            context['oversold'] = error.offer_ids
+            return self.render_to_response(self.get_context_data(**context))
+        cart.clear()
+        if order.buyer_id:
+            return redirect('order-detail', pk=order.id)
+        messages.success(request, _('Order %(order_id)d has been placed') % {'order_id': order.id})
+        return redirect('home')
+
+
+class OrderHistoryView(LoginRequiredMixin, TemplateView):
+    """
+    Представление для отображения истории заказов покупателя
+    """
+    template_name = 'pages/historyorder.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['orders'] = get_orders_page(self.request.user, self.request.GET.get(CURSOR_PARAM))
+        return context
+
+
+class OrderDetailView(LoginRequiredMixin, DetailView):
+    """
+    Представление для отображения заказа покупателя
+    """
+    template_name = 'pages/oneorder.html'
+    context_object_name = 'order'
+
+    def get_queryset(self):
+        return get_buyer_orders(self.request.user)
+
 
 class ComparisonView(TemplateView):
   MAX_VALUE = 3
@@ -312,11 +445,13 @@ class ComparisonView(TemplateView):
     comparison_products = self.request.session.get('comparison_products', default=[])[:3]
     if comparison_products and isinstance(comparison_products, list) and len(comparison_products) <= self.MAX_VALUE:
       goods: QuerySet[Product] = Product.objects.filter(id__in=comparison_products) \
-        .annotate(avg_price=Avg('in_shops__price')) \
+        .with_offer_aggregates() \
         .select_related('category', 'main_image')
 
-      if len(set([item.category_id for item in goods])) == 1:
-        intersecting_features = self._get_intersecting_features(context, comparison_products)
+      category_ids = {item.category_id for item in goods}
+      if len(category_ids) == 1:
+        intersecting_features = self._get_intersecting_features(context, category_ids.pop(),
+                                                                [item.id for item in goods])
 
         comparison_list: QuerySet[Product] = goods.prefetch_related(
           Prefetch('features', queryset=FeatureToProduct.objects.order_by('feature_name')
@@ -330,49 +465,15 @@ class ComparisonView(TemplateView):
         context['comparison_list'] = goods
     return context
 
-  def _get_intersecting_features(self, context, goods):
-    is_difference = self.request.GET.get('is_difference')
-    if is_difference == 'True':
-      name_btn = _('Show all characteristics')
-      is_difference_value = 'False'
-      values = FeatureToProduct.objects.filter(product_id__in=goods) \
-        .values('product_id', 'feature_name') \
-        .annotate(values=ArrayAgg('values')) \
-        .order_by('product_id', 'feature_name')
-      result = {}
-      for item in values:
-        product_id = item['product_id']
-        feature_name = item['feature_name']
-        value = item['values']
-        if product_id in result:
-          result[product_id][feature_name] = value
-        else:
-          result[product_id] = {feature_name: value}
-
-      common_keys = set.intersection(*[set(d.keys()) for d in result.values()])
-      intersection_feature = {k: {key: value for key, value in v.items() if key in common_keys}
-                              for k, v in result.items()}
-
-      value_dict = defaultdict(set)
-      for v in intersection_feature.values():
-        for feature_name_id, value in v.items():
-          value_dict[feature_name_id].add(value[0])
-
-      value_dict = {k: v for k, v in value_dict.items() if len(v) > 1}
-      intersecting_features = value_dict.keys()
+  def _get_intersecting_features(self, context, category_id: int, goods: List[int]) -> List[int]:
+    is_difference = self.request.GET.get('is_difference') == 'True'
+    if is_difference:
+      context['name_btn'] = _('Show all characteristics')
+      context['is_difference_value'] = 'False'
     else:
-      name_btn = _('Only differing characteristics')
-      is_difference_value = 'True'
-
-      intersecting_features = FeatureToProduct.objects.filter(product_id__in=goods) \
-        .values('feature_name') \
-        .annotate(count=Count('product_id')) \
-        .filter(count=len(goods)) \
-        .values_list('feature_name_id', flat=True, named=False)
-
-    context['name_btn'] = name_btn
-    context['is_difference_value'] = is_difference_value
-    return intersecting_features
+      context['name_btn'] = _('Only differing characteristics')
+      context['is_difference_value'] = 'True'
+    return compare_features(category_id, goods, differing=is_difference)
 
   def post(self, request: HttpRequest) -> HttpResponse:
     current_page = request.META.get('HTTP_REFERER')
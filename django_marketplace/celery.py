@@ -2,13 +2,27 @@ import os
 from celery import Celery
 from celery.schedules import crontab
 
+from django_marketplace.constants import DISCOUNT_SCHEDULE_INTERVAL, ORDER_RESERVATION_RELEASE_INTERVAL
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_marketplace.settings')
 app = Celery('django_marketplace')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.conf.beat_schedule = {
-    'auto_discount_invalidate': {
-        'task': 'discount_invalidate',
-        'schedule': crontab(minute='00')
-    }
+    'auto_schedule_discounts': {
+        'task': 'schedule_discounts',
+        'schedule': DISCOUNT_SCHEDULE_INTERVAL
+    },
+    'auto_flush_sales': {
+        'task': 'flush_sales',
+        'schedule': crontab(minute='*')
+    },
+    'auto_refresh_category_statistics': {
+        'task': 'refresh_category_statistics',
+        'schedule': crontab(minute='30')
+    },
+    'auto_release_order_reservations': {
+        'task': 'release_order_reservations',
+        'schedule': ORDER_RESERVATION_RELEASE_INTERVAL
+    },
 }
 app.autodiscover_tasks()
@@ -5,3 +5,58 @@ CATEGORIES_CACHE_LIFETIME = timedelta(days=1).total_seconds()
 SORT_OPTIONS_CACHE_LIFETIME = timedelta(days=2).total_seconds()
 TAGS_CACHE_LIFETIME = timedelta(days=1).total_seconds()
 SALES_CACHE_LIFETIME = timedelta(days=1).total_seconds()
+CATALOG_CACHE_LIFETIME = timedelta(hours=1).total_seconds()
+
+# Количество первых страниц списков, доступных по номеру; дальше навигация идет по курсору
+PAGE_NUMBER_LIMIT = 5
+
+# Максимальный размер выдачи каталога, список id которой сохраняется в кэше
+CATALOG_CACHE_MAX_IDS = 1000
+
+# Как часто процесс сверяет свою таблицу курсов валют с версией в общем кэше, в секундах
+EXCHANGE_RATES_RECHECK_INTERVAL = timedelta(minutes=1).total_seconds()
+
+# Время жизни закэшированных секций главной страницы
+HOME_SECTION_CACHE_LIFETIME = timedelta(hours=1).total_seconds()
+
+# Размер рейтинга самых продаваемых товаров каталога и каждой категории
+TOP_SELLERS_SIZE = 20
+TOP_SELLERS_CACHE_LIFETIME = timedelta(days=1).total_seconds()
+# Максимальное количество записей журнала продаж, сворачиваемых в счетчики за один проход
+SALES_FLUSH_BATCH_SIZE = 5000
+
+# Время жизни снимка страницы товара
+PRODUCT_PAGE_CACHE_LIFETIME = timedelta(days=1).total_seconds()
+
+# Количество отзывов на странице товара и в каждой подгружаемой порции
+REVIEWS_PAGE_SIZE = 10
+
+# Как часто ставятся задачи на ближайшие границы периодов скидок и на сколько вперед, в секундах.
+# Горизонт должен быть меньше таймаута видимости сообщений брокера, иначе отложенные задачи доставляются повторно
+DISCOUNT_SCHEDULE_INTERVAL = timedelta(minutes=15).total_seconds()
+DISCOUNT_SCHEDULE_HORIZON = timedelta(minutes=20).total_seconds()
+
+# Время жизни матрицы характеристик категории и результатов сравнения товаров по ней
+FEATURE_MATRIX_CACHE_LIFETIME = timedelta(days=1).total_seconds()
+
+# Время жизни инвертированного индекса значений характеристик категории
+FEATURE_INDEX_CACHE_LIFETIME = timedelta(days=1).total_seconds()
+
+# Время жизни содержимого и итогов корзины в кэше: после истечения они читаются из таблицы строк корзин
+CART_CACHE_LIFETIME = timedelta(days=7).total_seconds()
+
+# Сколько неоплаченный заказ удерживает товары на складе и как часто снимаются истекшие резервы
+ORDER_RESERVATION_LIFETIME = timedelta(minutes=30).total_seconds()
+ORDER_RESERVATION_RELEASE_INTERVAL = timedelta(minutes=5).total_seconds()
+
+# Количество заказов на странице истории заказов
+ORDERS_PAGE_SIZE = 10
+
+# Кэш справочных данных (категории, теги, варианты сортировки, распродажи):
+# сколько значений хранит процесс, как часто он сверяет их версии с общим кэшем и как долго
+# один процесс может строить значение, пока остальные ждут его или отдают прежнее
+REFERENCE_CACHE_MAX_ENTRIES = 64
+REFERENCE_CACHE_RECHECK_INTERVAL = timedelta(seconds=5).total_seconds()
+REFERENCE_CACHE_LOCK_TIMEOUT = timedelta(seconds=30).total_seconds()
+# Коэффициент досрочного перестроения: чем больше, тем раньше до истечения значение начинает перестраиваться
+REFERENCE_CACHE_EARLY_EXPIRATION_BETA = 1.0
@@ -1,23 +1,29 @@
-from typing import Dict
+from typing import Dict, List
 
-from django.core.cache import cache
+from django.db.models import Prefetch
 from django.http import HttpRequest
+from django.utils.functional import SimpleLazyObject
 
 from app_shops.models.category import Category
+from app_shops.services.reference_cache import get_reference
 from django_marketplace.constants import CATEGORIES_CACHE_LIFETIME
 
-from app_cart.cart import Cart
+from app_cart.cart import get_cart_summary
+
+
+def _build_categories() -> List[Category]:
+    return list(Category.objects.filter(is_active=True).select_related('parent', 'statistics')
+                .prefetch_related(Prefetch('child_category', queryset=Category.objects.select_related('statistics'))))
 
 
 def get_categories(request: HttpRequest) -> Dict:
-    categories = cache.get_or_set('categories',
-                                  Category.objects.filter(is_active=True).select_related('parent').prefetch_related(
-                                      'child_category'), timeout=CATEGORIES_CACHE_LIFETIME)
+    categories = get_reference('categories', _build_categories, timeout=CATEGORIES_CACHE_LIFETIME)
     query_params = request.GET.copy()
     query_params.pop('price', None)
     redirect_to = f'{request.path}?{query_params.urlencode()}'
     return {"categories": categories, 'redirect_to': redirect_to}
 
 
-def get_cart(request):
-    return {'cart': Cart(request)}
+def get_cart(request: HttpRequest) -> Dict:
+    """Итоги корзины для шапки сайта. Вычисляются, только если шаблон к ним обращается"""
+    return {'cart_summary': SimpleLazyObject(lambda: get_cart_summary(request))}
@@ -178,6 +178,8 @@ CACHES = {
 
 
 USER_AGENTS_CACHE = 'default'
+# Общий кэш справочных данных за кэшем в памяти процесса: локальный Redis или файловый кэш
+REFERENCE_CACHE = 'default'
 
 AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend',
@@ -207,6 +209,7 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 
 CART_SESSION_ID = 'cart'
+CART_STORAGE = 'app_cart.storage.CacheCartStorage'
 CURRENCIES = ('RUB',)
 BASE_CURRENCY = 'RUB'
 EXCHANGE_BACKEND = 'app_shops.services.functions.CBRExchangeBackend'
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app_shops.services.category_tree import rebuild_category_tree
+
+
+class Command(BaseCommand):
+    help = 'Full rebuild of the category tree index (materialized paths)'
+
+    def handle(self, *args, **kwargs) -> None:
+        count = rebuild_category_tree()
+        self.stdout.write(self.style.SUCCESS(f'Category tree rebuilt: {count} categories'))
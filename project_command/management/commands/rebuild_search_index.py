@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from app_shops.models.product import Product
+from app_shops.services.search import update_search_vectors
+
+
+class Command(BaseCommand):
+    help = 'Full rebuild of product full-text search vectors'
+
+    def handle(self, *args, **kwargs) -> None:
+        update_search_vectors(Product.objects.all())
+        self.stdout.write(self.style.SUCCESS('Search vectors rebuilt'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from app_shops.services.currency import update_converted_prices
+from app_shops.services.discounts import switch_discounts, update_effective_prices
+from app_shops.services.statistics import refresh_product_statistics, refresh_category_statistics
+
+
+class Command(BaseCommand):
+    help = 'Full rebuild of converted and discounted prices and denormalized product and category statistics'
+
+    def handle(self, *args, **kwargs) -> None:
+        update_converted_prices()
+        switch_discounts()
+        update_effective_prices()
+        refresh_product_statistics()
+        refresh_category_statistics()
+        self.stdout.write(self.style.SUCCESS('Converted and discounted prices, product and category statistics rebuilt'))
@@ -3,11 +3,15 @@ from django.core.management.base import BaseCommand
 
 
 class Command(BaseCommand):
-    help = 'commands are executed: migrations, fixtures, compilemessages, update_rates, createsuperuser'
+    help = 'commands are executed: migrations, fixtures, rebuild_category_tree, rebuild_statistics, ' \
+           'rebuild_search_index, compilemessages, update_rates, createsuperuser'
 
     def handle(self, *args, **kwargs) -> None:
         management.call_command('migration')
         management.call_command('fixtures')
+        management.call_command('rebuild_category_tree')
+        management.call_command('rebuild_statistics')
+        management.call_command('rebuild_search_index')
         management.call_command('compilemessages', '--locale=ru', '--locale=en')
         print('Getting the exchange rate...')
         management.call_command('update_rates')